@@ -1,7 +1,12 @@
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes.routes import router as base_router
 from app.routes.auth import router as auth_router
+from app.routes.map import router as map_router
+from app.routes.metrics import router as metrics_router
+from app.routes.stats import router as stats_router
+from app.metrics import http_request_seconds
 
 # fastapi entrypoint file
 app = FastAPI()
@@ -21,4 +26,25 @@ app.add_middleware(
 )
 
 app.include_router(base_router)
-app.include_router(auth_router)
\ No newline at end of file
+app.include_router(auth_router)
+app.include_router(map_router)
+app.include_router(metrics_router)
+app.include_router(stats_router)
+
+# per-route latency, labelled by the route template so ids in paths don't
+# create new series; streamed responses are timed to their first byte
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        http_request_seconds.labels(
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status),
+        ).observe(time.perf_counter() - started)
\ No newline at end of file
@@ -0,0 +1,101 @@
+# Local archive of raw ReliefWeb pages, so re-ingests, benchmarks and
+# regression runs can replay real responses without the network.
+#
+# Layout: one directory per fetched date window, one gzip NDJSON file per
+# page offset, each line one raw report exactly as the API returned it:
+#
+#   {ARCHIVE_DIR}/20250101T000000Z_20250102T000000Z/window.json
+#   {ARCHIVE_DIR}/20250101T000000Z_20250102T000000Z/offset-000000.ndjson.gz
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ARCHIVE_DIR = Path(os.getenv("RELIEFWEB_ARCHIVE_DIR", Path(__file__).resolve().parent.parent / "archive"))
+ARCHIVE_ENABLED = os.getenv("RELIEFWEB_ARCHIVE", "0") == "1"
+
+WINDOW_FORMAT = "%Y%m%dT%H%M%SZ"
+
+def _utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def window_dir(start, end):
+    return ARCHIVE_DIR / f"{_utc(start).strftime(WINDOW_FORMAT)}_{_utc(end).strftime(WINDOW_FORMAT)}"
+
+def page_path(start, end, offset):
+    return window_dir(start, end) / f"offset-{offset:06d}.ndjson.gz"
+
+def _write_atomic(path, write):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+def archive_window(start, end, total_count, limit):
+    meta = {
+        "start": _utc(start).isoformat(),
+        "end": _utc(end).isoformat(),
+        "totalCount": total_count,
+        "limit": limit,
+        "archived_at": datetime.now(timezone.utc).isoformat(),
+    }
+    _write_atomic(window_dir(start, end) / "window.json", lambda tmp: tmp.write_text(json.dumps(meta)))
+
+def archive_page(start, end, offset, reports):
+    def write(tmp):
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for report in reports:
+                f.write(json.dumps(report, ensure_ascii=False))
+                f.write("\n")
+    _write_atomic(page_path(start, end, offset), write)
+
+# Writes reports to the page file as they are yielded, for the streaming
+# fetcher; the file only appears once the page has been read to the end.
+def tee_page(start, end, offset, reports):
+    path = page_path(start, end, offset)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        for report in reports:
+            f.write(json.dumps(report, ensure_ascii=False))
+            f.write("\n")
+            yield report
+    os.replace(tmp, path)
+
+def parse_window(name):
+    start, _, end = name.partition("_")
+    return (
+        datetime.strptime(start, WINDOW_FORMAT).replace(tzinfo=timezone.utc),
+        datetime.strptime(end, WINDOW_FORMAT).replace(tzinfo=timezone.utc),
+    )
+
+# archived windows overlapping [start, end], oldest first
+def archived_windows(start=None, end=None):
+    if not ARCHIVE_DIR.exists():
+        return []
+    windows = []
+    for path in ARCHIVE_DIR.iterdir():
+        try:
+            w_start, w_end = parse_window(path.name)
+        except ValueError:
+            continue
+        if start is not None and w_end < _utc(start):
+            continue
+        if end is not None and w_start > _utc(end):
+            continue
+        windows.append((w_start, w_end, path))
+    return sorted(windows)
+
+# raw reports from one archived window, page by page, one line at a time
+def iter_archived_reports(path):
+    for page in sorted(Path(path).glob("offset-*.ndjson.gz")):
+        with gzip.open(page, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
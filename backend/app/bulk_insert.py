@@ -0,0 +1,321 @@
+import hashlib
+import io
+import math
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from app.db import engine
+from app.partitions import ensure_partitions, month_start
+from app.db_models.worldevent import ReportRow
+from app.dedupe import assign_clusters, store_signatures
+from app.rollups import apply_rollup_delta
+from app.metrics import ingest_dropped
+
+# column order used for the staging COPY and the upsert into test_reports;
+# ReportRow tuples from the fetcher are already in this order
+REPORT_COLUMNS = list(ReportRow._fields)
+
+# REPORT_COLUMNS plus the hash used to skip reports that haven't changed and
+# the near-duplicate cluster assigned by app.dedupe
+STAGED_COLUMNS = REPORT_COLUMNS + ["content_hash", "cluster_id"]
+
+REQUIRED_TEXT = ("primary_country", "primary_country_iso3")
+INT_COLUMNS = ("report_id", "disaster_id")
+
+# temp table lives for one transaction, so every batch starts from an empty stage
+CREATE_STAGING_TABLE = """
+    CREATE TEMP TABLE staging_reports (
+    seq INTEGER NOT NULL,
+    report_id INTEGER,
+    primary_country TEXT,
+    primary_country_iso3 TEXT,
+    primary_country_shortname TEXT,
+    country_lat REAL,
+    country_long REAL,
+    date_report_created TIMESTAMP WITH TIME ZONE,
+    headline_title TEXT,
+    headline_summary TEXT,
+    language TEXT,
+    source_name TEXT,
+    source_homepage TEXT,
+    report_url_alias TEXT,
+    disaster_id INTEGER,
+    disaster_name TEXT,
+    disaster_glide TEXT,
+    disaster_type TEXT,
+    disaster_status TEXT,
+    content_hash TEXT,
+    cluster_id INTEGER
+    ) ON COMMIT DROP;
+"""
+
+_cols = ", ".join(STAGED_COLUMNS)
+_updates = ",\n    ".join(
+    f"{c} = EXCLUDED.{c}" for c in STAGED_COLUMNS if c not in ("report_id", "date_report_created")
+)
+
+# test_reports is partitioned by date_report_created, so the key is
+# (report_id, date_report_created). A report whose creation date changed is
+# removed from its old partition first and inserted into the new one.
+DELETE_MOVED_REPORTS = """
+    DELETE FROM test_reports t
+    USING staging_reports s
+    WHERE s.seq BETWEEN :lo AND :hi
+    AND t.report_id = s.report_id
+    AND t.date_report_created <> s.date_report_created;
+"""
+
+# one set-based upsert per seq range; DISTINCT ON keeps the last copy of a report
+# that shows up twice in a page, otherwise ON CONFLICT would touch the same row twice
+UPSERT_FROM_STAGING = f"""
+    WITH upserted AS (
+        INSERT INTO test_reports ({_cols}, geom)
+        SELECT DISTINCT ON (report_id) {_cols},
+        ST_SetSRID(ST_MakePoint(country_long, country_lat), 4326)
+        FROM staging_reports
+        WHERE seq BETWEEN :lo AND :hi
+        ORDER BY report_id, seq DESC
+        ON CONFLICT (report_id, date_report_created) DO UPDATE SET
+        {_updates}
+        WHERE test_reports.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT
+        COUNT(*) FILTER (WHERE inserted) AS inserted,
+        COUNT(*) FILTER (WHERE NOT inserted) AS updated
+    FROM upserted;
+"""
+
+EXISTING_HASHES = """
+    SELECT report_id, content_hash FROM test_reports
+    WHERE report_id = ANY(:report_ids);
+"""
+
+def _as_dict(report):
+    if isinstance(report, dict):
+        return report
+    if isinstance(report, (list, tuple)):
+        return dict(zip(REPORT_COLUMNS, report))
+    return dict(report)
+
+# a new list of the report's values in REPORT_COLUMNS order; tuples and lists
+# (ReportRow, Celery payloads) are taken as already being in that order
+def _as_row(report):
+    if isinstance(report, (list, tuple)):
+        if len(report) != len(REPORT_COLUMNS):
+            raise ValueError(f"expected {len(REPORT_COLUMNS)} columns, got {len(report)}")
+        return list(report)
+    r = _as_dict(report)
+    return [r.get(col) for col in REPORT_COLUMNS]
+
+# compact JSON-safe form of a report for Celery payloads: values in
+# REPORT_COLUMNS order, dates as ISO strings
+def to_payload(report):
+    return [v.isoformat() if isinstance(v, datetime) else v for v in _as_row(report)]
+
+def _clean_text(value):
+    if value is None:
+        return None
+    # postgres text can't hold NUL bytes, they'd fail the whole COPY
+    return str(value).replace("\x00", "")
+
+ID = REPORT_COLUMNS.index("report_id")
+LAT = REPORT_COLUMNS.index("country_lat")
+LONG = REPORT_COLUMNS.index("country_long")
+DATE = REPORT_COLUMNS.index("date_report_created")
+DISASTER_ID = REPORT_COLUMNS.index("disaster_id")
+REQUIRED = [REPORT_COLUMNS.index(col) for col in REQUIRED_TEXT]
+TEXT = [i for i, col in enumerate(REPORT_COLUMNS) if col not in (*INT_COLUMNS, "country_lat", "country_long", "date_report_created")]
+
+def _to_int(value):
+    return int(value) if value is not None else None
+
+def _to_date(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+# Converts one column of a page in place. Values that fail conversion mark
+# their row bad with `reason`; rows already bad are skipped.
+def _convert_column(values, convert, reason, bad):
+    for i, value in enumerate(values):
+        if i in bad:
+            continue
+        try:
+            values[i] = convert(value)
+        except (TypeError, ValueError):
+            bad[i] = reason
+
+def _check_column(values, ok, reason, bad):
+    for i, value in enumerate(values):
+        if i not in bad and not ok(value):
+            bad[i] = reason
+
+def _valid_coordinate(value):
+    return value is not None and not math.isnan(value)
+
+# Validates a whole page column by column and returns its valid rows in
+# REPORT_COLUMNS order with the content hash appended. Rows test_reports would
+# reject are dropped: counted in stats["failed"], recorded per reason in the
+# ingest_dropped metric and reported in one summary line per page. Works on
+# positional rows throughout, so no per-report model or dict is built.
+def prepare_rows(reports, stats):
+    rows, malformed = [], 0
+    for report in reports:
+        try:
+            rows.append(_as_row(report))
+        except (TypeError, ValueError):
+            malformed += 1
+
+    bad = {}
+    columns = [list(column) for column in zip(*rows)] if rows else []
+    if columns:
+        _convert_column(columns[ID], _to_int, "invalid_report_id", bad)
+        _check_column(columns[ID], bool, "missing_report_id", bad)
+        _convert_column(columns[DISASTER_ID], _to_int, "invalid_disaster_id", bad)
+        for i in (LAT, LONG):
+            _convert_column(columns[i], float, f"missing_{REPORT_COLUMNS[i]}", bad)
+            _check_column(columns[i], _valid_coordinate, f"missing_{REPORT_COLUMNS[i]}", bad)
+        _check_column(columns[LAT], lambda v: -90 <= v <= 90, "coordinates_out_of_range", bad)
+        _check_column(columns[LONG], lambda v: -180 <= v <= 180, "coordinates_out_of_range", bad)
+        _convert_column(columns[DATE], _to_date, "invalid_date_report_created", bad)
+        _check_column(columns[DATE], lambda v: isinstance(v, datetime), "missing_date_report_created", bad)
+        for i in TEXT:
+            columns[i] = [_clean_text(value) for value in columns[i]]
+        for i in REQUIRED:
+            _check_column(columns[i], bool, f"missing_{REPORT_COLUMNS[i]}", bad)
+
+    prepared = []
+    for i, row in enumerate(zip(*columns)):
+        if i not in bad:
+            row = list(row)
+            row.append(content_hash(row))
+            prepared.append(row)
+
+    reasons = Counter(bad.values())
+    if malformed:
+        reasons["malformed"] = malformed
+    if reasons:
+        stats["failed"] += sum(reasons.values())
+        ingest_dropped.inc_many(reasons)
+        print(f"Skipped {sum(reasons.values())} invalid reports of {len(rows) + malformed}: "
+              + ", ".join(f"{reason}={count}" for reason, count in reasons.most_common()))
+    return prepared
+
+# hashes the prepared values joined on the unit separator; None gets a NUL,
+# which _clean_text has already stripped from every text value, so a missing
+# value never hashes like an empty one
+def content_hash(row):
+    payload = "\x1f".join("\x00" if value is None else str(value) for value in row)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+# splits prepared rows into new/changed/unchanged against what's already stored,
+# so unchanged reports never get staged or rewritten
+def split_unchanged(conn, rows, stats):
+    ids = [row[0] for row in rows]
+    existing = dict(conn.execute(text(EXISTING_HASHES), {"report_ids": ids}).all())
+
+    changed = []
+    for row in rows:
+        if row[0] not in existing:
+            stats["new"] += 1
+            changed.append(row)
+        elif existing[row[0]] != row[-1]:
+            stats["changed"] += 1
+            changed.append(row)
+        else:
+            stats["unchanged"] += 1
+    return changed
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+def _copy_buffer(rows):
+    buf = io.StringIO()
+    for seq, row in enumerate(rows):
+        buf.write(str(seq))
+        for value in row:
+            buf.write("\t")
+            buf.write(_copy_value(value))
+        buf.write("\n")
+    buf.seek(0)
+    return buf
+
+def _upsert_range(conn, lo, hi, stats):
+    # run the set-based upsert under a savepoint; if it fails, split the range
+    # in half so a bad row costs O(log n) statements instead of a retry per row.
+    # The rollup delta reads the stored rows, so it goes first and shares the
+    # savepoint: a rejected range leaves the counts untouched too.
+    # Returns the seqs of the rejected rows.
+    try:
+        with conn.begin_nested():
+            apply_rollup_delta(conn, lo, hi)
+            conn.execute(text(DELETE_MOVED_REPORTS), {"lo": lo, "hi": hi})
+            inserted, updated = conn.execute(
+                text(UPSERT_FROM_STAGING), {"lo": lo, "hi": hi}
+            ).one()
+        stats["inserted"] += inserted
+        stats["updated"] += updated
+        return []
+    except DBAPIError as e:
+        if lo == hi:
+            stats["failed"] += 1
+            print(f"Rejected staged row {lo}: {getattr(e, 'orig', e)}")
+            return [lo]
+        mid = (lo + hi) // 2
+        return _upsert_range(conn, lo, mid, stats) + _upsert_range(conn, mid + 1, hi, stats)
+
+# loads a page of reports into test_reports in one transaction:
+# COPY into a temp stage, then one set-based upsert building geom server-side.
+# Partitions for the months in the page are created beforehand if missing
+# (reports for months past retention are dropped as expired),
+# new or changed reports are assigned near-duplicate clusters, and the daily
+# rollup counts move with the rows.
+# The table itself is owned by the migrations in backend/migrations.
+def bulk_upsert_reports(reports):
+    stats = {
+        "new": 0, "changed": 0, "unchanged": 0,
+        "inserted": 0, "updated": 0, "failed": 0, "expired": 0,
+    }
+
+    rows = prepare_rows(reports, stats)
+    if not rows:
+        return stats
+
+    # reports for months past retention have no partition to go to
+    expired = ensure_partitions(row[DATE] for row in rows)
+    if expired:
+        kept = [row for row in rows if month_start(row[DATE]) not in expired]
+        stats["expired"] += len(rows) - len(kept)
+        rows = kept
+        if not rows:
+            return stats
+
+    with engine.begin() as conn:
+        rows = split_unchanged(conn, rows, stats)
+        if not rows:
+            return stats
+        signatures = assign_clusters(conn, rows, STAGED_COLUMNS)
+        conn.execute(text(CREATE_STAGING_TABLE))
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY staging_reports (seq, {_cols}) FROM STDIN",
+                _copy_buffer(rows),
+            )
+        finally:
+            cursor.close()
+        rejected = {rows[seq][ID] for seq in _upsert_range(conn, 0, len(rows) - 1, stats)}
+        # rejected rows were never written, so later reports mustn't match them
+        store_signatures(conn, [e for e in signatures if e["report_id"] not in rejected])
+
+    return stats
@@ -2,15 +2,34 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 from datetime import datetime
+from functools import lru_cache
 import os
 
 load_dotenv()
 
 connection_string = os.getenv("DATABASE_CONN_STRING") or "postgresql+psycopg2://postgres:@localhost:5432/globedb_dev"
 #print(connection_string)
-engine = create_engine(connection_string, pool_pre_ping=True, connect_args={"sslmode": "require"})
+# local postgres/postgis containers usually run without TLS
+sslmode = os.getenv("DATABASE_SSLMODE", "require")
+engine = create_engine(connection_string, pool_pre_ping=True, connect_args={"sslmode": sslmode})
 SessionLocal = sessionmaker(autocommit = False, autoflush = False, bind = engine)
 
+# asyncpg engine for the async routes; same database, different driver
+def async_url(url):
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+async_connection_string = os.getenv("ASYNC_DATABASE_CONN_STRING") or async_url(connection_string)
+
+# created on first use, so the Celery workers and migrate (sync only) never
+# load sqlalchemy.ext.asyncio or need asyncpg/greenlet
+@lru_cache(maxsize=None)
+def get_async_engine():
+    from sqlalchemy.ext.asyncio import create_async_engine
+    return create_async_engine(async_connection_string, pool_pre_ping=True, connect_args={"ssl": sslmode})
+
 def check_conn():
     try:
         with engine.connect() as cursor:
@@ -1,5 +1,5 @@
 from sqlalchemy import create_engine, text
-from typing import Optional
+from typing import NamedTuple, Optional
 from pydantic import BaseModel
 import os
 from datetime import datetime
@@ -29,6 +29,29 @@ class ReportData(BaseModel):
     disaster_type: Optional[str]
     disaster_status: Optional[str]
 
+# Compact form of a report on the ingest path: a plain tuple in the column
+# order of test_reports, with no per-instance validation. bulk_insert
+# validates whole pages of these at once before they are written.
+class ReportRow(NamedTuple):
+    report_id: int
+    primary_country: str
+    primary_country_iso3: str
+    primary_country_shortname: Optional[str]
+    country_lat: float
+    country_long: float
+    date_report_created: datetime
+    headline_title: Optional[str]
+    headline_summary: Optional[str]
+    language: Optional[str]
+    source_name: Optional[str]
+    source_homepage: Optional[str]
+    report_url_alias: Optional[str]
+    disaster_id: Optional[int]
+    disaster_name: Optional[str]
+    disaster_glide: Optional[str]
+    disaster_type: Optional[str]
+    disaster_status: Optional[str]
+
 def test_insert():
     query = """
     INSERT INTO test_table  (name)
@@ -0,0 +1,278 @@
+# Ingest-time near-duplicate detection. ReliefWeb often carries the same
+# situation report from several sources or as repeated updates; those copies
+# get the same cluster_id so read paths can show one of them.
+#
+# Each report's normalized title + summary is cut into word 3-shingles and
+# summarized by a one-permutation MinHash signature (SIGNATURE_BINS bins,
+# one pass over the shingles). Signatures are split into LSH bands; reports
+# sharing a band bucket within the same scope (primary_country, disaster_id)
+# are candidates, and a candidate whose estimated Jaccard similarity is at
+# least DEDUPE_THRESHOLD joins that candidate's cluster. Otherwise the report
+# starts a cluster of its own, keyed by its report_id.
+#
+# Ingest only clusters new or changed reports. Reports stored before clustering
+# existed have no cluster_id and no signatures until they are backfilled:
+#
+#   python -m app.dedupe backfill            the last DEDUPE_WINDOW_DAYS
+#   python -m app.dedupe backfill --days 90
+import argparse
+import json
+import os
+import re
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from app.db import engine
+from app.db_models.worldevent import ReportRow
+from app.rollups import rebuild_rollups
+
+load_dotenv()
+
+DEDUPE_ENABLED = os.getenv("DEDUPE_ENABLED", "1") == "1"
+DEDUPE_THRESHOLD = float(os.getenv("DEDUPE_THRESHOLD", "0.8"))
+# how long signatures are kept to match later reports against
+DEDUPE_WINDOW_DAYS = int(os.getenv("DEDUPE_WINDOW_DAYS", "30"))
+# long bodies are compared on their opening words only
+DEDUPE_MAX_WORDS = int(os.getenv("DEDUPE_MAX_WORDS", "400"))
+
+SHINGLE_WORDS = 3
+SIGNATURE_BINS = 64
+BAND_ROWS = 4
+BANDS = SIGNATURE_BINS // BAND_ROWS
+BIN_BITS = SIGNATURE_BINS.bit_length() - 1
+
+WORD = re.compile(r"\w+")
+
+CANDIDATES_QUERY = """
+    SELECT q.scope, q.band, q.bucket, m.report_id, m.signature, m.cluster_id
+    FROM unnest(CAST(:scopes AS TEXT[]), CAST(:bands AS SMALLINT[]), CAST(:buckets AS INTEGER[]))
+        AS q(scope, band, bucket)
+    JOIN report_lsh_buckets b ON b.scope = q.scope AND b.band = q.band AND b.bucket = q.bucket
+    JOIN report_minhash m ON m.report_id = b.report_id;
+"""
+
+DELETE_SIGNATURES = "DELETE FROM report_minhash WHERE report_id = ANY(:report_ids);"
+
+INSERT_SIGNATURES = """
+    INSERT INTO report_minhash (report_id, scope, date_report_created, signature, cluster_id)
+    SELECT report_id, scope, date_report_created, signature, cluster_id
+    FROM json_to_recordset(CAST(:rows AS JSON)) AS r(
+        report_id INTEGER, scope TEXT, date_report_created TIMESTAMPTZ,
+        signature INTEGER[], cluster_id INTEGER
+    )
+    ON CONFLICT (report_id) DO NOTHING;
+"""
+
+INSERT_BUCKETS = """
+    INSERT INTO report_lsh_buckets (scope, band, bucket, report_id)
+    SELECT scope, band, bucket, report_id
+    FROM json_to_recordset(CAST(:rows AS JSON)) AS r(
+        scope TEXT, band SMALLINT, bucket INTEGER, report_id INTEGER
+    )
+    ON CONFLICT DO NOTHING;
+"""
+
+PRUNE_SIGNATURES = "DELETE FROM report_minhash WHERE date_report_created < :cutoff;"
+
+BACKFILL_BATCH = 1000
+BACKFILL_COLUMNS = list(ReportRow._fields)
+
+# keyset walk over stored reports, oldest first, so roots are assigned before
+# the copies that should join them
+BACKFILL_PAGE_QUERY = f"""
+    SELECT {", ".join(BACKFILL_COLUMNS)}
+    FROM test_reports
+    WHERE date_report_created >= :since
+    AND (date_report_created, report_id) > (CAST(:after_date AS TIMESTAMPTZ), :after_id)
+    ORDER BY date_report_created, report_id
+    LIMIT :limit;
+"""
+
+SET_CLUSTER_IDS = """
+    UPDATE test_reports t SET cluster_id = v.cluster_id
+    FROM unnest(CAST(:report_ids AS INTEGER[]), CAST(:dates AS TIMESTAMPTZ[]), CAST(:cluster_ids AS INTEGER[]))
+        AS v(report_id, date_report_created, cluster_id)
+    WHERE t.report_id = v.report_id AND t.date_report_created = v.date_report_created
+    AND t.cluster_id IS DISTINCT FROM v.cluster_id;
+"""
+
+def scope_key(primary_country, disaster_id):
+    return f"{(primary_country or '').lower()}|{disaster_id or ''}"
+
+def shingles(title, summary):
+    words = WORD.findall(f"{title or ''} {summary or ''}".lower())[:DEDUPE_MAX_WORDS]
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+# One-permutation MinHash: each shingle hash picks a bin by its low bits and
+# competes for that bin's minimum with the rest. Empty bins borrow from the
+# next non-empty bin so every position is comparable. None for empty text.
+def signature(title, summary):
+    grams = shingles(title, summary)
+    if not grams:
+        return None
+    bins = [None] * SIGNATURE_BINS
+    for gram in grams:
+        h = zlib.crc32(gram.encode("utf-8"))
+        slot, value = h & (SIGNATURE_BINS - 1), h >> BIN_BITS
+        if bins[slot] is None or value < bins[slot]:
+            bins[slot] = value
+    for i in range(SIGNATURE_BINS):
+        if bins[i] is None:
+            j = 1
+            while bins[(i + j) % SIGNATURE_BINS] is None:
+                j += 1
+            bins[i] = bins[(i + j) % SIGNATURE_BINS]
+    return bins
+
+def band_buckets(sig):
+    return [
+        zlib.crc32(struct.pack(f"<H{BAND_ROWS}I", band, *sig[band * BAND_ROWS:(band + 1) * BAND_ROWS])) & 0x7FFFFFFF
+        for band in range(BANDS)
+    ]
+
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / SIGNATURE_BINS
+
+def _bucket_keys(entry):
+    return [(entry["scope"], band, bucket) for band, bucket in enumerate(entry["buckets"])]
+
+def _load_candidates(conn, entries):
+    keys = [key for entry in entries for key in _bucket_keys(entry)]
+    params = {
+        "scopes": [k[0] for k in keys],
+        "bands": [k[1] for k in keys],
+        "buckets": [k[2] for k in keys],
+    }
+    found = {}
+    try:
+        with conn.begin_nested():
+            for scope, band, bucket, report_id, sig, cluster_id in conn.execute(text(CANDIDATES_QUERY), params):
+                found.setdefault((scope, band, bucket), []).append((report_id, sig, cluster_id))
+    except DBAPIError as e:
+        print("Duplicate candidate lookup failed:", getattr(e, "orig", e))
+    return found
+
+# Appends a cluster_id to every prepared row (see bulk_insert.prepare_rows) and
+# returns the signatures to store once the rows are written. Rows are matched
+# against stored signatures and against each other, oldest first, so the
+# earliest copy of a report roots its cluster. Rows without any text get no
+# cluster.
+def assign_clusters(conn, rows, columns):
+    if not DEDUPE_ENABLED:
+        for row in rows:
+            row.append(None)
+        return []
+
+    at = {col: i for i, col in enumerate(columns)}
+    entries = []
+    for row in rows:
+        sig = signature(row[at["headline_title"]], row[at["headline_summary"]])
+        entries.append(None if sig is None else {
+            "report_id": row[at["report_id"]],
+            "scope": scope_key(row[at["primary_country"]], row[at["disaster_id"]]),
+            "date_report_created": row[at["date_report_created"]].isoformat(),
+            "signature": sig,
+            "buckets": band_buckets(sig),
+        })
+
+    buckets = _load_candidates(conn, [e for e in entries if e is not None]) if any(entries) else {}
+
+    order = sorted(range(len(rows)), key=lambda i: (rows[i][at["date_report_created"]], rows[i][at["report_id"]]))
+    for i in order:
+        entry = entries[i]
+        if entry is None:
+            rows[i].append(None)
+            continue
+        best, best_score = None, DEDUPE_THRESHOLD
+        for key in _bucket_keys(entry):
+            for report_id, sig, cluster_id in buckets.get(key, ()):
+                if report_id == entry["report_id"]:
+                    continue
+                score = similarity(entry["signature"], sig)
+                if score >= best_score:
+                    best, best_score = cluster_id, score
+        entry["cluster_id"] = best if best is not None else entry["report_id"]
+        rows[i].append(entry["cluster_id"])
+        for key in _bucket_keys(entry):
+            buckets.setdefault(key, []).append((entry["report_id"], entry["signature"], entry["cluster_id"]))
+
+    return [e for e in entries if e is not None]
+
+# Replaces the stored signatures and band buckets of these reports. Runs in a
+# savepoint: losing signatures only weakens future matching, so it never
+# fails the ingest batch.
+def store_signatures(conn, entries):
+    if not entries:
+        return
+    signatures = [
+        {k: e[k] for k in ("report_id", "scope", "date_report_created", "signature", "cluster_id")}
+        for e in entries
+    ]
+    buckets = [
+        {"scope": scope, "band": band, "bucket": bucket, "report_id": e["report_id"]}
+        for e in entries
+        for scope, band, bucket in _bucket_keys(e)
+    ]
+    try:
+        with conn.begin_nested():
+            conn.execute(text(DELETE_SIGNATURES), {"report_ids": [e["report_id"] for e in entries]})
+            conn.execute(text(INSERT_SIGNATURES), {"rows": json.dumps(signatures)})
+            conn.execute(text(INSERT_BUCKETS), {"rows": json.dumps(buckets)})
+    except DBAPIError as e:
+        print("Failed to store report signatures:", getattr(e, "orig", e))
+
+# drops signatures older than DEDUPE_WINDOW_DAYS (their buckets cascade)
+def prune_signatures(now=None):
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=DEDUPE_WINDOW_DAYS)
+    with engine.begin() as conn:
+        deleted = conn.execute(text(PRUNE_SIGNATURES), {"cutoff": cutoff}).rowcount
+    print(f"Pruned {deleted} report signatures older than {cutoff.isoformat()}")
+    return deleted
+
+# One-off clustering of reports already in test_reports (see the header), one
+# transaction per BACKFILL_BATCH reports. Safe to re-run: a report never
+# matches its own stored signature. The rollup days covered are rebuilt at
+# the end, since cluster roots decide the `events` counts.
+def backfill_clusters(days=None, now=None):
+    days = DEDUPE_WINDOW_DAYS if days is None else days
+    since = (now or datetime.now(timezone.utc)) - timedelta(days=days)
+    after_date, after_id = since, 0
+    updated = seen = 0
+    while True:
+        with engine.begin() as conn:
+            rows = [list(r) for r in conn.execute(text(BACKFILL_PAGE_QUERY), {
+                "since": since, "after_date": after_date, "after_id": after_id, "limit": BACKFILL_BATCH,
+            })]
+            if not rows:
+                break
+            at = {col: i for i, col in enumerate(BACKFILL_COLUMNS)}
+            after_date, after_id = rows[-1][at["date_report_created"]], rows[-1][at["report_id"]]
+            entries = assign_clusters(conn, rows, BACKFILL_COLUMNS)
+            updated += conn.execute(text(SET_CLUSTER_IDS), {
+                "report_ids": [row[at["report_id"]] for row in rows],
+                "dates": [row[at["date_report_created"]] for row in rows],
+                "cluster_ids": [row[-1] for row in rows],
+            }).rowcount
+            store_signatures(conn, entries)
+        seen += len(rows)
+    print(f"Clustered {seen} reports since {since.isoformat()}, {updated} cluster ids changed")
+    if updated:
+        rebuild_rollups(since)
+    return {"reports": seen, "updated": updated}
+
+def main():
+    parser = argparse.ArgumentParser(description="near-duplicate clustering maintenance")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--days", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        backfill_clusters(args.days)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from urllib.parse import urlencode
+import ijson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+from app.db_models.worldevent import ReportRow
+from app.archive import ARCHIVE_ENABLED, archive_page, archive_window, tee_page
+from app.metrics import ingest_stage_seconds, ingest_reports, ingest_dropped
+
+load_dotenv()
+
+# overridable so ingestion can be pointed at a local stub server
+RELIEFWEB_URL = os.getenv("RELIEFWEB_API_URL", "https://api.reliefweb.int/v1/reports")
+FETCH_CONCURRENCY = int(os.getenv("RELIEFWEB_CONCURRENCY", "4"))
+FETCH_TIMEOUT = float(os.getenv("RELIEFWEB_TIMEOUT", "30"))
+FETCH_RETRIES = int(os.getenv("RELIEFWEB_RETRIES", "5"))
+
+APPNAME = "atlascope"
+
+_session = None
+
+def get_session():
+    global _session
+    if _session is None:
+        retry = Retry(
+            total=FETCH_RETRIES,
+            backoff_factor=1,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_connections=1,
+            pool_maxsize=max(FETCH_CONCURRENCY, 1),
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+def build_params(start, end, offset=0, limit=1000):
+    return {
+        "appname": APPNAME,
+        "filter[conditions][0][field]": "date.created",
+        "filter[conditions][0][value][from]": start.isoformat(),
+        "filter[conditions][0][value][to]": end.isoformat(),
+        "sort[]": "date.created:desc",
+        "fields[include][]": [
+            "disaster",
+            "body",
+            "id",
+            "primary_country",
+            "source",
+            "source.type.name",
+            "date",
+            "language",
+            "url_alias"
+        ],
+        "limit": limit,
+        "offset": offset
+    }
+
+# Raw ReliefWeb response for one page, retried with backoff on 429/5xx.
+# With archiving on (RELIEFWEB_ARCHIVE=1) the raw reports are also written to
+# the local page archive for offline replay.
+def fetch_page(start, end, offset=0, limit=1000, base_url=None, archive=None):
+    encoded_params = urlencode(build_params(start, end, offset, limit), doseq=True)
+    full_url = f"{base_url or RELIEFWEB_URL}?{encoded_params}"
+    started = time.perf_counter()
+    res = get_session().get(full_url, timeout=FETCH_TIMEOUT)
+    res.raise_for_status()
+    data = res.json()
+    ingest_stage_seconds.observe(time.perf_counter() - started, stage="fetch")
+    if ARCHIVE_ENABLED if archive is None else archive:
+        if offset == 0:
+            archive_window(start, end, data.get("totalCount"), limit)
+        archive_page(start, end, offset, data.get("data") or [])
+    return data
+
+def dropped(drops, reason):
+    if drops is not None:
+        drops[reason] += 1
+    return None
+
+# applies the ingest filters to one raw ReliefWeb report and returns it as a
+# ReportRow (or `row_type`, which benchmarks use to build the old pydantic
+# ReportData), or None if it's dropped, counting the reason in `drops` when given
+def parse_report(report, drops=None, row_type=ReportRow):
+    report_id = int(report.get("id", None))
+    if not report_id:
+        return dropped(drops, "no_id")
+    fields = report.get("fields")
+    language = fields.get("language", [])[0].get("name", None)
+    if language != "English":
+        return dropped(drops, "not_english")
+    country_data = fields.get("primary_country", {})
+    primary_country = country_data.get("name")
+    if primary_country == "World":
+        return dropped(drops, "world")
+    headline_title = fields.get("title", None)
+    if "Location Map" in headline_title or "Monthly Snapshot" in headline_title:
+        return dropped(drops, "map_product")
+    country_lat = country_data.get("location", {}).get("lat", None)
+    country_long = country_data.get("location", {}).get("lon", None)
+    if not country_lat or not country_long:
+        return dropped(drops, "no_location")
+    disaster_data = fields.get("disaster", [])
+    disaster_status = disaster_data[0].get("status", None) if disaster_data else None
+    if disaster_status and disaster_status == "past":
+        return dropped(drops, "past_disaster")
+    disaster_id = disaster_data[0].get("id", None) if disaster_data else None
+    disaster_name = disaster_data[0].get("name", None) if disaster_data else None
+    disaster_glide = disaster_data[0].get("glide", None) if disaster_data else None
+    disaster_type = disaster_data[0].get("type", [])[0].get("name", None) if disaster_data else None
+    primary_country_iso3 = country_data.get("iso3")
+    primary_country_shortname = country_data.get("shortname", None)
+    date = fields.get("date",{}).get("created", None)
+    date_report_created = datetime.fromisoformat(date)
+
+    headline_summary = fields.get("body", None)
+    source_name = fields.get("source", [])[0].get("shortname", None)
+    source_homepage = fields.get("source", [])[0].get("homepage", None)
+    report_url_alias = fields.get("url_alias", None)
+
+    return row_type(
+        report_id = report_id,
+        primary_country = primary_country,
+        primary_country_iso3 = primary_country_iso3,
+        primary_country_shortname = primary_country_shortname,
+        country_lat = country_lat,
+        country_long = country_long,
+        date_report_created = date_report_created,
+        headline_title = headline_title,
+        headline_summary = headline_summary,
+        language = language,
+        source_name = source_name,
+        source_homepage = source_homepage,
+        report_url_alias = report_url_alias,
+        disaster_id = disaster_id,
+        disaster_name = disaster_name,
+        disaster_glide = disaster_glide,
+        disaster_type = disaster_type,
+        disaster_status = disaster_status
+    )
+
+def record_parse(seen, kept, drops):
+    ingest_reports.inc_many({"fetched": seen, "kept": kept})
+    ingest_dropped.inc_many(drops)
+
+def parse_reports(data):
+    started = time.perf_counter()
+    drops = Counter()
+    results = []
+    for report in data or []:
+        parsed = parse_report(report, drops)
+        if parsed is not None:
+            results.append(parsed)
+    ingest_stage_seconds.observe(time.perf_counter() - started, stage="parse")
+    record_parse(len(data or []), len(results), drops)
+    return results
+
+# Yields (offset, reports) for every page in [start, end], in offset order.
+# The first page tells us totalCount; the remaining offsets are fetched by a
+# bounded pool with at most `concurrency` pages in flight at once.
+def iter_report_pages(start, end, limit=1000, max_pages=1000, concurrency=None, base_url=None):
+    concurrency = max(concurrency or FETCH_CONCURRENCY, 1)
+
+    first = fetch_page(start, end, offset=0, limit=limit, base_url=base_url)
+    yield 0, parse_reports(first.get("data"))
+
+    total = int(first.get("totalCount") or 0)
+    offsets = iter(range(limit, min(total, limit * max_pages), limit))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = deque()
+
+        def submit_next():
+            offset = next(offsets, None)
+            if offset is not None:
+                future = pool.submit(fetch_page, start, end, offset, limit, base_url)
+                in_flight.append((offset, future))
+
+        for _ in range(concurrency):
+            submit_next()
+
+        while in_flight:
+            offset, future = in_flight.popleft()
+            data = future.result()
+            submit_next()
+            yield offset, parse_reports(data.get("data"))
+
+# Streams the raw report objects of one page straight off the socket, so only
+# one report is ever decoded at a time regardless of the page limit.
+def stream_page(start, end, offset=0, limit=1000, base_url=None):
+    encoded_params = urlencode(build_params(start, end, offset, limit), doseq=True)
+    full_url = f"{base_url or RELIEFWEB_URL}?{encoded_params}"
+    with get_session().get(full_url, timeout=FETCH_TIMEOUT, stream=True) as res:
+        res.raise_for_status()
+        res.raw.decode_content = True
+        items = ijson.items(res.raw, "data.item", use_float=True)
+        if ARCHIVE_ENABLED:
+            items = tee_page(start, end, offset, items)
+        yield from items
+
+# Yields every report in [start, end] that passes the ingest filters, one at a
+# time. A page with fewer raw items than `limit` is the last one.
+def iter_streamed_reports(start, end, limit=1000, max_pages=1000, base_url=None):
+    for page in range(max_pages):
+        seen = kept = 0
+        drops = Counter()
+        for raw in stream_page(start, end, offset=page * limit, limit=limit, base_url=base_url):
+            seen += 1
+            report = parse_report(raw, drops)
+            if report is not None:
+                kept += 1
+                yield report
+        record_parse(seen, kept, drops)
+        if seen < limit:
+            break
+
+def iter_batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import re
+import time
+from decimal import Decimal
+import orjson
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+# level 1: normalized question -> generate() output (the expensive LLM call)
+SQL_CACHE_TTL = int(os.getenv("LLM_SQL_CACHE_TTL", str(7 * 86400)))
+SQL_CACHE_MAX_KEYS = int(os.getenv("LLM_SQL_CACHE_MAX_KEYS", "5000"))
+# level 2: (data version, sql) -> result rows; a new ingestion run bumps the
+# data version, so stale rows are simply never looked up again
+ROWS_CACHE_TTL = int(os.getenv("LLM_ROWS_CACHE_TTL", "3600"))
+ROWS_CACHE_MAX_KEYS = int(os.getenv("LLM_ROWS_CACHE_MAX_KEYS", "1000"))
+ROWS_CACHE_MAX_BYTES = int(os.getenv("LLM_ROWS_CACHE_MAX_BYTES", str(2 * 1024 * 1024)))
+
+DATA_VERSION_KEY = "reports:data_version"
+STATS_KEY = "llm-cache:stats"
+
+def normalize_question(question: str):
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.strip(" ?!.")
+
+def sha1_hex(value: str):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+def record_hit(level: str, hit: bool):
+    try:
+        redis_client.hincrby(STATS_KEY, f"{level}_{'hit' if hit else 'miss'}", 1)
+    except redis.RedisError:
+        pass
+
+# Reads a cached value and bumps its recency in the level's index, in one
+# round trip. Any Redis failure is a miss: the cache must never break a query.
+def _get(level: str, key: str):
+    try:
+        pipe = redis_client.pipeline()
+        pipe.get(key)
+        pipe.zadd(f"llm-cache:{level}:index", {key: time.time()}, xx=True)
+        value = pipe.execute()[0]
+    except redis.RedisError as e:
+        print(f"LLM cache read failed ({level}):", e)
+        value = None
+    record_hit(level, value is not None)
+    return value
+
+# Stores a value with a TTL and trims the level back to max_keys by evicting
+# the least recently used entries.
+def _set(level: str, key: str, value, ttl: int, max_keys: int):
+    index = f"llm-cache:{level}:index"
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(key, value, ex=ttl)
+        pipe.zadd(index, {key: time.time()})
+        pipe.zcard(index)
+        size = pipe.execute()[-1]
+        if size > max_keys:
+            evicted = [k for k, _ in redis_client.zpopmin(index, size - max_keys)]
+            if evicted:
+                redis_client.delete(*evicted)
+                redis_client.hincrby(STATS_KEY, f"{level}_evicted", len(evicted))
+    except redis.RedisError as e:
+        print(f"LLM cache write failed ({level}):", e)
+
+def get_cached_sql(question: str):
+    value = _get("sql", f"llm-cache:sql:{sha1_hex(normalize_question(question))}")
+    return orjson.loads(value) if value else None
+
+def cache_sql(question: str, response: dict):
+    key = f"llm-cache:sql:{sha1_hex(normalize_question(question))}"
+    _set("sql", key, orjson.dumps(response).decode("utf-8"), SQL_CACHE_TTL, SQL_CACHE_MAX_KEYS)
+
+def get_data_version():
+    try:
+        return redis_client.get(DATA_VERSION_KEY) or "0"
+    except redis.RedisError:
+        return "0"
+
+# called after every ingestion run
+def bump_data_version():
+    return redis_client.incr(DATA_VERSION_KEY)
+
+def _rows_key(sql: str):
+    return f"llm-cache:rows:{get_data_version()}:{sha1_hex(sql)}"
+
+def get_cached_rows(sql: str):
+    value = _get("rows", _rows_key(sql))
+    return orjson.loads(value) if value else None
+
+def cache_rows(sql: str, rows: list):
+    payload = orjson.dumps(rows, default=json_default)
+    if len(payload) > ROWS_CACHE_MAX_BYTES:
+        return
+    _set("rows", _rows_key(sql), payload.decode("utf-8"), ROWS_CACHE_TTL, ROWS_CACHE_MAX_KEYS)
+
+def cache_stats():
+    try:
+        stats = {k: int(v) for k, v in redis_client.hgetall(STATS_KEY).items()}
+        stats["sql_size"] = redis_client.zcard("llm-cache:sql:index")
+        stats["rows_size"] = redis_client.zcard("llm-cache:rows:index")
+        stats["data_version"] = int(get_data_version())
+        return stats
+    except redis.RedisError as e:
+        return {"status": "error", "detail": str(e)}
@@ -4,6 +4,9 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain.output_parsers.structured import StructuredOutputParser, ResponseSchema
 from dotenv import load_dotenv
 import os
+import re
+import time
+from app.metrics import record_llm_call
 
 load_dotenv()
 llm_key = os.getenv("OPENAI_API_KEY")
@@ -22,6 +25,11 @@ REGION_MAP = {
     "middle east": ["Iran", "Iraq", "Syria", "Saudi Arabia", "Jordan", "Israel", "Yemen", "United Arab Emirates", "Lebanon", "Oman", "Qatar", "occupied Palestinian territory", "Kuwait", "Palestine", "Bahrain", "Türkiye"]
 }
 
+# REGION_MAP names are SQL literals as the prompt shows them (Côte d''Ivoire);
+# the plain country names, for bound parameters and matching user text
+def region_countries(region):
+    return [country.replace("''", "'") for country in REGION_MAP[region]]
+
 response_schemas = [
     ResponseSchema(name="sql", description="The SQL query to run"),
     ResponseSchema(name="highlight_condition", description="A condition(s) to highlight"),
@@ -29,64 +37,112 @@ response_schemas = [
 
 parser = StructuredOutputParser.from_response_schemas(response_schemas)
 
-def expand_region_terms(user_input: str) -> str:
-
-    prompt = (
-        "You are an assistant that turns user questions into SQL queries on a PostgreSQL database of disaster reports.\n"
-        "Return a JSON object containing:\n"
-        "1. `sql`: A SQL query to fetch relevant data from the `test_reports` table.\n"
-        "2. `highlight_condition`: A condition that the frontend can use to highlight specific rows (e.g., \"magnitude > 6\" or \"disaster_status = 'ongoing'\").\n"
-        "All entries in the table have only one country as their primary_country.\n"
-        "Note: A \"disaster\" should be defined as a report where `disaster_name` OR `disaster_type` is NOT NULL.\n"
-        "Do not check for disasters unless the prompt explicitly uses the word \"disaster\".\n"
-        "If a user asks for a count of events or disasters, ensure the SQL query always keeps the `country_long` and `country_lat` fields for the country or region the user specifies.\n"
-        "The SQL query should check if a country name matches on either the `primary_country` field or the `primary_country_shortname` field. Ex. (primary_country = 'Mexico' OR primary_country_shortname = 'Mexico')\n"
-        "You must always include the `report_id`, `date_report_created`, `headline_title`, `headline_summary`, `source_homepage`, `source_name`, `country_lat`, `country_long`, `primary_country`, `primary_country_shortname`, and `report_url_alias` fields in the SQL query, as it's necessary to parse reports correctly.\n" \
-        "If a user's input does not seem to be asking a question, simply return a sql query that returns an empty list.\n"
-        "If a user asks about geospatial distances, make sure that your sql query uses ST_DWithin with the `geom` field.\n"
-        "If a user asks for \"Turkey\", have the SQL query search for \"Türkiye\" instead for correct results.\n"
-        "References to \"Palestine\" should be mapped to \"occupied Palestinian territory\".\n"
-        "These are all the possible `disaster_type` fields. If none of these match a user's query, then check for keywords related to the user's query in the `headline_title` or `headline_summary instead.`\n"
-        "Mud Slide, Insect Infestation, Tsunami, Cold Wave, Fire, Complex Emergency, Extratropical Cyclone, Drought, Epidemic, Earthquake, Flash Flood, Technological Disaster, Snow Avalanche, Severe Local Storm, Wild Fire, Tropical Cyclone, Flood.\n"
-        "There are no other fields that you can use other than the ones below. Do not create new fields.\n"
-        "Table: `test_reports`\n"
-        "Columns:\n"
-        "- report_id: integer\n"
-        "- primary_country: text\n"
-        "- primary_country_iso3: text\n"
-        "- primary_country_shortname: text\n"
-        "- country_lat: float\n"
-        "- country_long: float\n"
-        "- geom: GEOGRAPHY(Point, 4326)\n"
-        "- date_report_created: timestamp with timezone\n"
-        "- headline_title: text\n"
-        "- headline_summary: text\n"
-        "- language: text\n"
-        "- source_name: text\n"
-        "- source_homepage: text\n"
-        "- report_url_alias: text\n"
-        "- disaster_id: integer\n"
-        "- disaster_name: text\n"
-        "- disaster_glide: text\n"
-        "- disaster_type: text\n"
-        "- disaster_status: text\n\n"
-        "{format_instructions}\n\n"
-        f"User question: {user_input}"
-    )
+PROMPT_TEMPLATE = (
+    "You are an assistant that turns user questions into SQL queries on a PostgreSQL database of disaster reports.\n"
+    "Return a JSON object containing:\n"
+    "1. `sql`: A SQL query to fetch relevant data from the `test_reports` table.\n"
+    "2. `highlight_condition`: A condition that the frontend can use to highlight specific rows (e.g., \"magnitude > 6\" or \"disaster_status = 'ongoing'\").\n"
+    "All entries in the table have only one country as their primary_country.\n"
+    "Note: A \"disaster\" should be defined as a report where `disaster_name` OR `disaster_type` is NOT NULL.\n"
+    "Do not check for disasters unless the prompt explicitly uses the word \"disaster\".\n"
+    "If a user asks for a count of events or disasters, ensure the SQL query always keeps the `country_long` and `country_lat` fields for the country or region the user specifies.\n"
+    "The SQL query should check if a country name matches on either the `primary_country` field or the `primary_country_shortname` field. Ex. (primary_country = 'Mexico' OR primary_country_shortname = 'Mexico')\n"
+    "You must always include the `report_id`, `date_report_created`, `headline_title`, `headline_summary`, `source_homepage`, `source_name`, `country_lat`, `country_long`, `primary_country`, `primary_country_shortname`, and `report_url_alias` fields in the SQL query, as it's necessary to parse reports correctly.\n" \
+    "If a user's input does not seem to be asking a question, simply return a sql query that returns an empty list.\n"
+    "If a user asks about geospatial distances, make sure that your sql query uses ST_DWithin with the `geom` field.\n"
+    "If a user asks for \"Turkey\", have the SQL query search for \"Türkiye\" instead for correct results.\n"
+    "References to \"Palestine\" should be mapped to \"occupied Palestinian territory\".\n"
+    "These are all the possible `disaster_type` fields. If none of these match a user's query, then check for keywords related to the user's query in the `headline_title` or `headline_summary instead.`\n"
+    "Mud Slide, Insect Infestation, Tsunami, Cold Wave, Fire, Complex Emergency, Extratropical Cyclone, Drought, Epidemic, Earthquake, Flash Flood, Technological Disaster, Snow Avalanche, Severe Local Storm, Wild Fire, Tropical Cyclone, Flood.\n"
+    "There are no other fields that you can use other than the ones below. Do not create new fields.\n"
+    "Table: `test_reports`\n"
+    "Columns:\n"
+    "- report_id: integer\n"
+    "- primary_country: text\n"
+    "- primary_country_iso3: text\n"
+    "- primary_country_shortname: text\n"
+    "- country_lat: float\n"
+    "- country_long: float\n"
+    "- geom: GEOGRAPHY(Point, 4326)\n"
+    "- date_report_created: timestamp with timezone\n"
+    "- headline_title: text\n"
+    "- headline_summary: text\n"
+    "- language: text\n"
+    "- source_name: text\n"
+    "- source_homepage: text\n"
+    "- report_url_alias: text\n"
+    "- disaster_id: integer\n"
+    "- disaster_name: text\n"
+    "- disaster_glide: text\n"
+    "- disaster_type: text\n"
+    "- disaster_status: text\n"
+    "- cluster_id: integer (reports with the same cluster_id are near-duplicate copies of one report; "
+    "when counting events, count DISTINCT COALESCE(cluster_id, report_id) rather than rows)\n\n"
+    "If a user only asks how many reports or events there are (per country, day, disaster type or status) and needs no report text, "
+    "query the `report_daily_counts` table instead, still keeping `country_lat` and `country_long`. "
+    "Use SUM(events) when counting events or disasters: it counts each near-duplicate cluster once, the same as "
+    "COUNT(DISTINCT COALESCE(cluster_id, report_id)) on `test_reports`. Use SUM(reports) only when the user asks for the number of reports. "
+    "The rule about always including report fields does not apply to this table.\n"
+    "Table: `report_daily_counts` (one row per day, country, disaster type and status)\n"
+    "Columns:\n"
+    "- day: date (UTC day of date_report_created)\n"
+    "- primary_country: text\n"
+    "- primary_country_shortname: text\n"
+    "- country_lat: float\n"
+    "- country_long: float\n"
+    "- disaster_type: text ('' when unknown)\n"
+    "- disaster_status: text ('' when unknown)\n"
+    "- reports: integer (number of raw reports, near-duplicates included)\n"
+    "- events: integer (number of distinct events: each near-duplicate cluster counted once)\n\n"
+    "{format_instructions}\n\n"
+    "User question: {user_question}{region_notes}"
+)
 
-    lowered = prompt.lower()
-    for region, countries in REGION_MAP.items():
-        if region in lowered:
-            country_list = ", ".join(countries)
-            prompt += f" (Note: {region.title()} includes {country_list})"
+# built once at import; the question and region notes are real template
+# variables, so user text is never parsed as part of the template
+prompt = PromptTemplate(
+    template=PROMPT_TEMPLATE,
+    input_variables=["user_question", "region_notes"],
+    partial_variables={"format_instructions": parser.get_format_instructions()},
+)
+# the model call is kept separate from parsing so its latency and token usage
+# can be recorded from the raw message
+completion = prompt | llm
+chain = completion | parser
 
-    return PromptTemplate(template=prompt)
+REGION_NOTES = {
+    region: f" (Note: {region.title()} includes {', '.join(countries)})"
+    for region, countries in REGION_MAP.items()
+}
+REGION_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(region) for region in REGION_MAP) + r")\b",
+    re.IGNORECASE,
+)
 
-def generate(user_input: str):
-    full_prompt = expand_region_terms(user_input)    
-    chain = full_prompt | llm | parser
-    res = chain.invoke(user_input)
-    return res
+# region notes for the regions named in the user's question, in REGION_MAP order
+def expand_region_terms(user_input: str) -> str:
+    found = {match.lower() for match in REGION_PATTERN.findall(user_input)}
+    return "".join(note for region, note in REGION_NOTES.items() if region in found)
 
+def chain_input(user_input: str):
+    return {"user_question": user_input, "region_notes": expand_region_terms(user_input)}
 
+def generate(user_input: str):
+    started = time.perf_counter()
+    try:
+        message = completion.invoke(chain_input(user_input))
+    except Exception:
+        record_llm_call(started, "error")
+        raise
+    record_llm_call(started, "ok", message)
+    return parser.invoke(message)
 
+async def agenerate(user_input: str):
+    started = time.perf_counter()
+    try:
+        message = await completion.ainvoke(chain_input(user_input))
+    except Exception:
+        record_llm_call(started, "error")
+        raise
+    record_llm_call(started, "ok", message)
+    return await parser.ainvoke(message)
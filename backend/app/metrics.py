@@ -0,0 +1,168 @@
+# Prometheus metrics. The API process records its own metrics (route latency,
+# LLM calls, generated SQL) with prometheus_client as usual. Ingestion runs in
+# Celery workers, which have no HTTP server to scrape, so the worker-side
+# metrics (ingest stages, drops, task timings) are aggregated in Redis hashes
+# under metrics:* and exported by the API's /metrics next to its own. Recording
+# a worker metric is one pipelined round-trip and never raises.
+import json
+import os
+import time
+from collections import defaultdict
+import redis
+from dotenv import load_dotenv
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=0.5)
+
+PREFIX = "geosynth"
+WORKER_METRICS_KEY = "metrics:{}"
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+class WorkerHistogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = f"{PREFIX}_{name}"
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.key = WORKER_METRICS_KEY.format(self.name)
+
+    def observe(self, value, **labels):
+        series = json.dumps([str(labels.get(n, "")) for n in self.labelnames])
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hincrby(self.key, f"{series}|count", 1)
+            pipe.hincrbyfloat(self.key, f"{series}|sum", value)
+            for bound in self.buckets:
+                if value <= bound:
+                    pipe.hincrby(self.key, f"{series}|{bound}", 1)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def collect(self, stored):
+        series = defaultdict(lambda: {"count": 0, "sum": 0.0, "buckets": {}})
+        for field, value in stored.items():
+            labels, _, part = field.rpartition("|")
+            if part == "count":
+                series[labels]["count"] = int(value)
+            elif part == "sum":
+                series[labels]["sum"] = float(value)
+            else:
+                series[labels]["buckets"][float(part)] = int(value)
+
+        family = HistogramMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for labels, data in series.items():
+            buckets = [(str(b), data["buckets"].get(b, 0)) for b in self.buckets]
+            buckets.append(("+Inf", data["count"]))
+            family.add_metric(json.loads(labels), buckets, data["sum"])
+        return family
+
+# single-label counter; the label value is the hash field
+class WorkerCounter:
+    def __init__(self, name, documentation, label):
+        self.name = f"{PREFIX}_{name}"
+        self.documentation = documentation
+        self.labelnames = (label,)
+        self.key = WORKER_METRICS_KEY.format(self.name)
+
+    # counts maps label values to increments, so a whole page of drops or
+    # upsert stats is one round-trip
+    def inc_many(self, counts):
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for value, amount in counts.items():
+                if amount:
+                    pipe.hincrbyfloat(self.key, str(value), amount)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def inc(self, value, amount=1):
+        self.inc_many({value: amount})
+
+    def collect(self, stored):
+        family = CounterMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for label, value in stored.items():
+            family.add_metric([label], float(value))
+        return family
+
+# worker side: ingestion stages and Celery tasks
+ingest_stage_seconds = WorkerHistogram(
+    "ingest_stage_seconds", "Time spent per ingestion stage (fetch, parse, upsert), per page or batch", ["stage"]
+)
+ingest_reports = WorkerCounter(
+    "ingest_reports", "Reports seen by ingestion, by outcome (fetched, kept, new, changed, unchanged, inserted, updated, failed, expired)", "outcome"
+)
+ingest_dropped = WorkerCounter("ingest_dropped", "Reports dropped by the ingest filters, by reason", "reason")
+celery_task_seconds = WorkerHistogram(
+    "celery_task_seconds", "Celery task run time", ["task", "state"], buckets=TASK_BUCKETS
+)
+celery_task_failures = WorkerCounter("celery_task_failures", "Celery tasks that raised", "task")
+report_partition_events = WorkerCounter(
+    "report_partition_events", "test_reports partition maintenance (retired, archive_renamed, refused, failed)", "event"
+)
+
+WORKER_METRICS = [
+    ingest_stage_seconds, ingest_reports, ingest_dropped, celery_task_seconds, celery_task_failures,
+    report_partition_events,
+]
+
+# API side
+http_request_seconds = Histogram(
+    f"{PREFIX}_http_request_seconds", "API request latency", ["method", "route", "status"]
+)
+llm_seconds = Histogram(
+    f"{PREFIX}_llm_seconds", "LLM call latency", ["outcome"], buckets=(0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+)
+llm_tokens = Counter(f"{PREFIX}_llm_tokens", "Tokens used by LLM calls", ["kind"])
+generated_sql_seconds = Histogram(
+    f"{PREFIX}_generated_sql_seconds", "Execution time of LLM-generated SQL", buckets=STAGE_BUCKETS
+)
+
+def record_llm_call(started, outcome, message=None):
+    llm_seconds.labels(outcome=outcome).observe(time.perf_counter() - started)
+    usage = getattr(message, "usage_metadata", None) or {}
+    for kind in ("input_tokens", "output_tokens"):
+        if usage.get(kind):
+            llm_tokens.labels(kind=kind.split("_")[0]).inc(usage[kind])
+
+# Exports the Redis-aggregated worker metrics plus connection pool usage of the
+# API's engines and Redis clients, read fresh on every scrape.
+class ScrapeTimeCollector:
+    def __init__(self, engines=None, redis_clients=None):
+        self.engines = engines or {}
+        self.redis_clients = redis_clients or {}
+
+    def collect(self):
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for metric in WORKER_METRICS:
+                pipe.hgetall(metric.key)
+            stored = pipe.execute()
+        except redis.RedisError:
+            stored = [{} for _ in WORKER_METRICS]
+        for metric, values in zip(WORKER_METRICS, stored):
+            yield metric.collect(values)
+
+        db_pool = GaugeMetricFamily(f"{PREFIX}_db_pool_connections", "SQLAlchemy pool connections", labels=["engine", "state"])
+        for name, engine in self.engines.items():
+            pool = getattr(engine, "sync_engine", engine).pool
+            if hasattr(pool, "checkedout"):
+                db_pool.add_metric([name, "checked_out"], pool.checkedout())
+                db_pool.add_metric([name, "idle"], pool.checkedin())
+                db_pool.add_metric([name, "overflow"], max(pool.overflow(), 0))
+                db_pool.add_metric([name, "size"], pool.size())
+        yield db_pool
+
+        redis_pool = GaugeMetricFamily(f"{PREFIX}_redis_pool_connections", "redis-py pool connections", labels=["client", "state"])
+        for name, client in self.redis_clients.items():
+            pool = client.connection_pool
+            redis_pool.add_metric([name, "in_use"], len(getattr(pool, "_in_use_connections", ())))
+            redis_pool.add_metric([name, "idle"], len(getattr(pool, "_available_connections", ())))
+        yield redis_pool
@@ -0,0 +1,235 @@
+# Versioned schema migrations. Files in backend/migrations named
+# NNNN_description.sql are applied once each, in order, and recorded in
+# schema_migrations. A file whose first line is "-- migrate: no-transaction"
+# runs statement by statement in autocommit (needed for CREATE INDEX
+# CONCURRENTLY); everything else runs in a single transaction.
+#
+#   python -m app.migrate up       apply pending migrations (run at deploy)
+#   python -m app.migrate status   list applied / pending migrations
+#   python -m app.migrate check    EXPLAIN the hot queries and verify index use
+import argparse
+import hashlib
+import json
+import re
+import sys
+from pathlib import Path
+from sqlalchemy import text
+from app.db import engine
+from app.snapshots import INITIAL_EVENTS_JSON_QUERY, MARKERS_JSON_QUERY
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+MIGRATION_FILE = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+NO_TRANSACTION = "-- migrate: no-transaction"
+# arbitrary key so concurrent deploys don't apply the same migration twice
+MIGRATION_LOCK_ID = 72_711_001
+
+CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        checksum TEXT NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    );
+"""
+
+def load_migrations():
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        match = MIGRATION_FILE.match(path.name)
+        if not match:
+            continue
+        sql = path.read_text()
+        migrations.append({
+            "version": int(match.group(1)),
+            "name": match.group(2),
+            "sql": sql,
+            "checksum": hashlib.sha1(sql.encode("utf-8")).hexdigest(),
+            "transactional": not sql.lstrip().startswith(NO_TRANSACTION),
+        })
+    return migrations
+
+DOLLAR_TAG = re.compile(r"\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$")
+
+# Splits a no-transaction file into statements on top-level semicolons only:
+# ';' inside '...' strings, "..." identifiers, $tag$ bodies and comments
+# doesn't end a statement. Comments are dropped.
+def split_statements(sql):
+    statements, current = [], []
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        if ch in ("'", '"'):
+            end = i + 1
+            while end < n:
+                if sql[end] == ch:
+                    # a doubled quote is an escaped quote
+                    if end + 1 < n and sql[end + 1] == ch:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        tag = DOLLAR_TAG.match(sql, i) if ch == "$" else None
+        if tag:
+            end = sql.find(tag.group(0), tag.end())
+            end = n if end == -1 else end + len(tag.group(0))
+            current.append(sql[i:end])
+            i = end
+            continue
+        if ch == ";":
+            statements.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    statements.append("".join(current).strip())
+    return [stmt for stmt in statements if stmt]
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version, checksum FROM schema_migrations;")
+    return dict(cursor.fetchall())
+
+def apply_migration(raw, migration):
+    cursor = raw.cursor()
+    try:
+        if migration["transactional"]:
+            raw.autocommit = False
+            cursor.execute(migration["sql"])
+        else:
+            raw.autocommit = True
+            for stmt in split_statements(migration["sql"]):
+                cursor.execute(stmt)
+            raw.autocommit = False
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+            (migration["version"], migration["name"], migration["checksum"]),
+        )
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def migrate_up():
+    raw = engine.raw_connection()
+    try:
+        raw.autocommit = True
+        cursor = raw.cursor()
+        cursor.execute(CREATE_MIGRATIONS_TABLE)
+        cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+        try:
+            applied = applied_versions(cursor)
+            pending = [m for m in load_migrations() if m["version"] not in applied]
+            if not pending:
+                print("Schema is up to date.")
+            for migration in pending:
+                print(f"Applying {migration['version']:04d}_{migration['name']}...")
+                apply_migration(raw, migration)
+            raw.autocommit = True
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+            cursor.close()
+    finally:
+        raw.close()
+
+def migrate_status():
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_MIGRATIONS_TABLE))
+        applied = dict(conn.execute(text("SELECT version, checksum FROM schema_migrations;")).all())
+    for migration in load_migrations():
+        version = migration["version"]
+        if version not in applied:
+            state = "pending"
+        elif applied[version] != migration["checksum"]:
+            state = "applied (file changed since)"
+        else:
+            state = "applied"
+        print(f"{version:04d}_{migration['name']}: {state}")
+
+# hot queries and the index each one is expected to use
+INDEX_CHECKS = [
+    ("initial-events", INITIAL_EVENTS_JSON_QUERY, {"three_weeks_ago": "2000-01-01"}, "idx_test_reports_date"),
+    ("markers", MARKERS_JSON_QUERY, {"three_weeks_ago": "2000-01-01"}, "idx_test_reports_date"),
+    ("last-updated", "SELECT MAX(date_report_created) FROM test_reports;", {}, "idx_test_reports_date"),
+    (
+        "viewport",
+        "SELECT report_id FROM test_reports WHERE geom::geometry && ST_MakeEnvelope(-20, -10, 40, 30, 4326);",
+        {},
+        "idx_test_reports_geom_planar",
+    ),
+    (
+        "distance",
+        "SELECT report_id FROM test_reports WHERE ST_DWithin(geom, ST_SetSRID(ST_MakePoint(36.8, -1.3), 4326)::geography, 500000);",
+        {},
+        "idx_test_reports_geom",
+    ),
+    (
+        "country",
+        "SELECT report_id FROM test_reports WHERE primary_country = 'Mexico' OR primary_country_shortname = 'Mexico';",
+        {},
+        "idx_test_reports_country",
+    ),
+    ("disaster-type", "SELECT report_id FROM test_reports WHERE disaster_type = 'Flood';", {}, "idx_test_reports_disaster_type"),
+    ("title-search", "SELECT report_id FROM test_reports WHERE headline_title ILIKE '%earthquake%';", {}, "idx_test_reports_title_trgm"),
+    ("summary-search", "SELECT report_id FROM test_reports WHERE headline_summary ILIKE '%cholera%';", {}, "idx_test_reports_summary_trgm"),
+]
+
+# indexes the planner can name for a partitioned index: the index itself and
+# the per-partition indexes attached to it
+PARTITION_INDEXES = """
+    SELECT c.relname FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(:index);
+"""
+
+def plan_indexes(node, found):
+    if "Index Name" in node:
+        found.add(node["Index Name"])
+    for child in node.get("Plans", []):
+        plan_indexes(child, found)
+    return found
+
+# Seq scans are disabled for the check: on a small dev table the planner would
+# rightly prefer them, but what we want to know is that an index exists that
+# can answer the query.
+def check_indexes():
+    failures = 0
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text("SET LOCAL enable_seqscan = off;"))
+            for name, query, params, expected in INDEX_CHECKS:
+                plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query.strip().rstrip(';')}"), params).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                found = plan_indexes(plan[0]["Plan"], set())
+                accepted = {expected} | set(conn.execute(text(PARTITION_INDEXES), {"index": expected}).scalars())
+                ok = bool(found & accepted)
+                failures += not ok
+                print(f"{'ok  ' if ok else 'FAIL'} {name}: expected {expected}, plan uses {sorted(found) or 'no index'}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="GeoSynth schema migrations")
+    parser.add_argument("command", choices=["up", "status", "check"], nargs="?", default="up")
+    args = parser.parse_args()
+
+    if args.command == "up":
+        migrate_up()
+    elif args.command == "status":
+        migrate_status()
+    elif check_indexes():
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# Monthly partitions of test_reports (see migrations/0004). Partitions are
+# created ahead of time by maintain_partitions and on demand at ingest time
+# for any month a batch touches, so upserts always have somewhere to route.
+# Months older than REPORT_RETENTION_MONTHS are detached and either moved to
+# the report_archive schema (still queryable, no longer scanned by the app)
+# or dropped, depending on REPORT_RETENTION_ACTION. Partitions are never
+# created for months past retention, so late or backfilled reports for a
+# retired month are refused instead of re-creating it.
+#
+#   python -m app.partitions list       partitions and their row estimates
+#   python -m app.partitions maintain   create upcoming months, apply retention
+import argparse
+import os
+import re
+import threading
+from datetime import date, datetime, timezone
+from dotenv import load_dotenv
+from sqlalchemy import text
+from app.db import engine
+from app.metrics import report_partition_events
+
+load_dotenv()
+
+# 0 keeps every month
+RETENTION_MONTHS = int(os.getenv("REPORT_RETENTION_MONTHS", "0"))
+# "archive" or "drop"
+RETENTION_ACTION = os.getenv("REPORT_RETENTION_ACTION", "archive")
+PARTITIONS_AHEAD = int(os.getenv("REPORT_PARTITIONS_AHEAD", "2"))
+ARCHIVE_SCHEMA = "report_archive"
+
+PARTITION_NAME = re.compile(r"^test_reports_(\d{4})_(\d{2})$")
+
+LIST_PARTITIONS = """
+    SELECT c.relname, c.reltuples::bigint
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'test_reports'::regclass
+    ORDER BY c.relname;
+"""
+
+ARCHIVED_TABLE_EXISTS = """
+    SELECT to_regclass(format('%I.%I', CAST(:schema AS TEXT), CAST(:name AS TEXT))) IS NOT NULL;
+"""
+
+# months this process has already ensured, so ingest only pays for the
+# partition check the first time it sees a month
+known_months = set()
+known_lock = threading.Lock()
+
+def month_start(value):
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return date(value.year, value.month, 1)
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+# first month still kept under REPORT_RETENTION_MONTHS, or None to keep all
+def retention_cutoff(now=None, retention_months=None):
+    retention_months = RETENTION_MONTHS if retention_months is None else retention_months
+    if retention_months <= 0:
+        return None
+    return add_months(month_start(now or datetime.now(timezone.utc)), -retention_months)
+
+# creates any missing partitions for the given months in its own short
+# transaction, so the brief lock on test_reports isn't held by an ingest batch.
+# Returns the months refused because they are past retention; their rows have
+# nowhere to go and must be dropped by the caller.
+def ensure_partitions(months):
+    months = {month_start(m) for m in months}
+    cutoff = retention_cutoff()
+    expired = {m for m in months if cutoff is not None and m < cutoff}
+    if expired:
+        report_partition_events.inc("refused", len(expired))
+    with known_lock:
+        missing = sorted(months - expired - known_months)
+    if not missing:
+        return expired
+    with engine.begin() as conn:
+        for month in missing:
+            conn.execute(text("SELECT ensure_report_partition(:month);"), {"month": month})
+    with known_lock:
+        known_months.update(missing)
+    return expired
+
+def list_partitions(conn):
+    partitions = []
+    for name, rows in conn.execute(text(LIST_PARTITIONS)).all():
+        match = PARTITION_NAME.match(name)
+        month = date(int(match.group(1)), int(match.group(2)), 1) if match else None
+        partitions.append({"name": name, "month": month, "rows": max(rows, 0)})
+    return partitions
+
+# An archived month that was re-created (e.g. before retention refused old
+# months) would clash with its earlier archive; the newer copy is archived
+# under a timestamp suffix instead.
+def retire_partition(conn, name, action=None):
+    action = action or RETENTION_ACTION
+    conn.execute(text(f'ALTER TABLE test_reports DETACH PARTITION "{name}";'))
+    if action == "drop":
+        conn.execute(text(f'DROP TABLE "{name}";'))
+    else:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA};"))
+        if conn.execute(text(ARCHIVED_TABLE_EXISTS), {"schema": ARCHIVE_SCHEMA, "name": name}).scalar():
+            renamed = f"{name}_{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+            conn.execute(text(f'ALTER TABLE "{name}" RENAME TO "{renamed}";'))
+            report_partition_events.inc("archive_renamed")
+            print(f"{ARCHIVE_SCHEMA}.{name} already exists; archiving as {renamed}")
+            name = renamed
+        conn.execute(text(f'ALTER TABLE "{name}" SET SCHEMA {ARCHIVE_SCHEMA};'))
+    with known_lock:
+        known_months.clear()
+
+# Creates partitions for this month and PARTITIONS_AHEAD months after it, then
+# retires whole months older than the retention window. Returns what it did.
+def maintain_partitions(now=None, retention_months=None):
+    current = month_start(now or datetime.now(timezone.utc))
+    ensure_partitions(add_months(current, i) for i in range(PARTITIONS_AHEAD + 1))
+
+    retired = []
+    cutoff = retention_cutoff(current, retention_months)
+    if cutoff is not None:
+        with engine.begin() as conn:
+            for partition in list_partitions(conn):
+                if partition["month"] is not None and partition["month"] < cutoff:
+                    retire_partition(conn, partition["name"])
+                    retired.append(partition["name"])
+    if retired:
+        report_partition_events.inc("retired", len(retired))
+        print(f"Retired partitions ({RETENTION_ACTION}): {', '.join(retired)}")
+    return {"retired": retired, "action": RETENTION_ACTION}
+
+def main():
+    parser = argparse.ArgumentParser(description="test_reports partition maintenance")
+    parser.add_argument("command", choices=["list", "maintain"], nargs="?", default="list")
+    args = parser.parse_args()
+
+    if args.command == "maintain":
+        maintain_partitions()
+    with engine.connect() as conn:
+        for partition in list_partitions(conn):
+            print(f"{partition['name']}: ~{partition['rows']} rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# Offline near-duplicate matching of questions to previously generated SQL.
+# Questions are compared with character 3-gram TF-IDF cosine similarity; no
+# network or model calls are involved. Two questions only match when their
+# keys are equal: the same places (regions/countries from REGION_MAP), numbers,
+# time words, disaster types and aggregate words. So "floods in Brazil" can
+# never reuse the SQL for "floods in Chile", "... today" the SQL for an
+# undated question, or "how many wildfires" the SQL that lists them, however
+# similar the strings are.
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+import orjson
+import redis
+from app.llm_cache import redis_client, normalize_question, record_hit, sha1_hex
+from app.llm_chain import REGION_MAP, region_countries
+
+SIMILARITY_THRESHOLD = float(os.getenv("LLM_SIMILARITY_THRESHOLD", "0.75"))
+MAX_QUESTIONS = int(os.getenv("LLM_SIMILAR_MAX_QUESTIONS", "5000"))
+# how often a process reloads questions answered by other workers
+SYNC_SECONDS = int(os.getenv("LLM_SIMILAR_SYNC_SECONDS", "60"))
+
+QUESTIONS_KEY = "llm-cache:questions"
+QUESTIONS_INDEX_KEY = "llm-cache:questions:index"
+
+# aliases the prompt already tells the model about
+ENTITY_ALIASES = {
+    "turkey": "türkiye",
+    "palestine": "occupied palestinian territory",
+}
+
+def _build_entity_pattern():
+    names = set(REGION_MAP)
+    for region in REGION_MAP:
+        names.update(c.lower() for c in region_countries(region))
+    names.update(ENTITY_ALIASES)
+    # longest first so "south sudan" wins over "sudan"
+    alternation = "|".join(re.escape(n) for n in sorted(names, key=len, reverse=True))
+    return re.compile(rf"\b({alternation})\b")
+
+# spellings of the prompt's disaster types (and common names for them),
+# mapped to one canonical form; "disaster" itself changes the SQL too
+DISASTER_TERMS = {
+    "disaster": r"disasters?",
+    "flood": r"flash ?floods?|floods?|flooding",
+    "wild fire": r"wild ?fires?|forest fires?|bush ?fires?",
+    "fire": r"fires?",
+    "earthquake": r"earthquakes?|quakes?|seismic",
+    "tsunami": r"tsunamis?",
+    "tropical cyclone": r"tropical cyclones?|cyclones?|hurricanes?|typhoons?",
+    "storm": r"storms?|tornado(?:es|s)?|extratropical cyclones?",
+    "drought": r"droughts?",
+    "epidemic": r"epidemics?|outbreaks?|pandemics?|cholera|ebola|disease",
+    "cold wave": r"cold waves?|cold snaps?|blizzards?",
+    "heat wave": r"heat ?waves?",
+    "mud slide": r"mud ?slides?|land ?slides?|avalanches?",
+    "insect infestation": r"insect infestations?|locusts?",
+    "technological disaster": r"technological disasters?|industrial accidents?|chemical spills?",
+    "complex emergency": r"complex emergenc(?:y|ies)|conflicts?|wars?",
+    "volcano": r"volcan(?:o|oes|ic)|eruptions?",
+}
+TIME_TERMS = (
+    r"today|tonight|yesterday|now|currently|current|recently|recent|latest|ongoing|"
+    r"(?:this|last|past|previous|next) (?:day|week|month|year)|days?|weeks?|months?|years?|"
+    r"january|february|march|april|june|july|august|september|october|november|december|"
+    # "may" only as a month: next to a day/year number or after a preposition,
+    # never the modal verb in "may I see ..."
+    r"may(?= \d)|(?<=\d )may|" + "|".join(f"(?<={word} )may" for word in ("in", "of", "since", "during", "until", "before", "after"))
+)
+AGGREGATE_TERMS = {
+    "count": r"how many|count|number of|total",
+    "average": r"average|avg|mean",
+    "rank": r"most|least|top|highest|lowest",
+    "per": r"per|each|by country|by type",
+}
+
+def _terms_pattern(alternation):
+    return re.compile(rf"\b({alternation})\b")
+
+ENTITY_PATTERN = _build_entity_pattern()
+NUMBER_PATTERN = re.compile(r"\d+")
+TIME_PATTERN = _terms_pattern(TIME_TERMS)
+DISASTER_PATTERNS = {name: _terms_pattern(terms) for name, terms in DISASTER_TERMS.items()}
+AGGREGATE_PATTERNS = {name: _terms_pattern(terms) for name, terms in AGGREGATE_TERMS.items()}
+
+def _matching(patterns, normalized):
+    return frozenset(name for name, pattern in patterns.items() if pattern.search(normalized))
+
+def question_key(normalized: str):
+    entities = {ENTITY_ALIASES.get(m, m) for m in ENTITY_PATTERN.findall(normalized)}
+    numbers = set(NUMBER_PATTERN.findall(normalized))
+    times = {m.rstrip("s") for m in TIME_PATTERN.findall(normalized)}
+    return (
+        frozenset(entities),
+        frozenset(numbers),
+        frozenset(times),
+        _matching(DISASTER_PATTERNS, normalized),
+        _matching(AGGREGATE_PATTERNS, normalized),
+    )
+
+def ngrams(normalized: str, n: int = 3):
+    padded = f" {normalized} "
+    return Counter(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+class QuestionIndex:
+    def __init__(self):
+        self.entries = {}
+        self.postings = defaultdict(set)
+        self.doc_freq = Counter()
+        # normalized tf-idf vectors of stored questions; idf changes with every
+        # add/remove, so the cache is dropped then and refilled lazily by find
+        self.weights = {}
+        self.lock = threading.Lock()
+        self.synced_at = 0.0
+
+    def _add_local(self, digest, normalized, response):
+        if digest in self.entries:
+            return
+        grams = ngrams(normalized)
+        self.entries[digest] = {
+            "question": normalized,
+            "response": response,
+            "key": question_key(normalized),
+            "grams": grams,
+        }
+        for gram in grams:
+            self.postings[gram].add(digest)
+            self.doc_freq[gram] += 1
+        self.weights.clear()
+
+    def _idf(self, gram):
+        return math.log((len(self.entries) + 1) / (self.doc_freq.get(gram, 0) + 1)) + 1
+
+    def _weights(self, grams):
+        weights = {g: count * self._idf(g) for g, count in grams.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {g: w / norm for g, w in weights.items()}
+
+    def _entry_weights(self, digest):
+        weights = self.weights.get(digest)
+        if weights is None:
+            weights = self.weights[digest] = self._weights(self.entries[digest]["grams"])
+        return weights
+
+    def sync(self, force=False):
+        if not force and time.time() - self.synced_at < SYNC_SECONDS:
+            return
+        try:
+            stored = redis_client.hgetall(QUESTIONS_KEY)
+        except redis.RedisError as e:
+            print("Failed to load question index:", e)
+            return
+        with self.lock:
+            for digest in set(self.entries) - set(stored):
+                self._remove_local(digest)
+            for digest, value in stored.items():
+                if digest not in self.entries:
+                    entry = orjson.loads(value)
+                    self._add_local(digest, entry["question"], entry["response"])
+            self.synced_at = time.time()
+
+    def _remove_local(self, digest):
+        entry = self.entries.pop(digest)
+        for gram in entry["grams"]:
+            self.postings[gram].discard(digest)
+            self.doc_freq[gram] -= 1
+        self.weights.clear()
+
+    # best previously answered question with exactly the same key, if its
+    # similarity clears the threshold
+    def find(self, question, threshold=None):
+        threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+        self.sync()
+        normalized = normalize_question(question)
+        key = question_key(normalized)
+
+        with self.lock:
+            query = self._weights(ngrams(normalized))
+            candidates = set()
+            for gram in query:
+                candidates |= self.postings.get(gram, set())
+
+            best, best_score = None, 0.0
+            for digest in candidates:
+                entry = self.entries[digest]
+                if entry["key"] != key:
+                    continue
+                weights = self._entry_weights(digest)
+                score = sum(w * weights.get(g, 0.0) for g, w in query.items())
+                if score > best_score:
+                    best, best_score = entry, score
+
+        if best is not None and best_score >= threshold:
+            print(f"Similar question hit ({best_score:.2f}): {best['question']!r}")
+            return best["response"]
+        return None
+
+    def add(self, question, response):
+        normalized = normalize_question(question)
+        digest = sha1_hex(normalized)
+        with self.lock:
+            self._add_local(digest, normalized, response)
+        try:
+            pipe = redis_client.pipeline()
+            pipe.hset(QUESTIONS_KEY, digest, orjson.dumps({"question": normalized, "response": response}))
+            pipe.zadd(QUESTIONS_INDEX_KEY, {digest: time.time()})
+            pipe.zcard(QUESTIONS_INDEX_KEY)
+            size = pipe.execute()[-1]
+            if size > MAX_QUESTIONS:
+                evicted = [d for d, _ in redis_client.zpopmin(QUESTIONS_INDEX_KEY, size - MAX_QUESTIONS)]
+                if evicted:
+                    redis_client.hdel(QUESTIONS_KEY, *evicted)
+        except redis.RedisError as e:
+            print("Failed to store question:", e)
+
+question_index = QuestionIndex()
+
+def find_similar_sql(question: str):
+    response = question_index.find(question)
+    record_hit("similar", response is not None)
+    return response
+
+def remember_question(question: str, response: dict):
+    question_index.add(question, response)
@@ -0,0 +1,140 @@
+# Sliding-window rate limiting as a FastAPI dependency. Each check is one
+# atomic Lua script on Redis (prune, count, record, expire), so concurrent
+# requests from one client can't race past the limit, and entries age out
+# individually instead of the whole window resetting on every call. If Redis
+# is unreachable, a per-process window is used so the API keeps limiting.
+import os
+import threading
+import time
+import uuid
+from collections import deque
+import redis
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request, Response
+from pydantic import BaseModel
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=0.5)
+
+SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+local allowed = 0
+if count < limit then
+    redis.call('ZADD', key, now, ARGV[4])
+    count = count + 1
+    allowed = 1
+end
+redis.call('PEXPIRE', key, window)
+local reset = window
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window - now
+end
+return {allowed, limit - count, reset}
+"""
+sliding_window = redis_client.register_script(SLIDING_WINDOW_SCRIPT)
+
+LOCAL_MAX_KEYS = 10000
+
+class RateLimitState(BaseModel):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_seconds: float
+    # limiters on the same route use different prefixes so neither's quota
+    # headers overwrite the other's
+    header_prefix: str = "X-RateLimit"
+
+    def headers(self):
+        prefix = self.header_prefix
+        headers = {
+            f"{prefix}-Limit": str(self.limit),
+            f"{prefix}-Remaining": str(max(self.remaining, 0)),
+            f"{prefix}-Reset": str(int(self.reset_seconds + 0.999)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = headers[f"{prefix}-Reset"]
+        return headers
+
+def client_ip(request: Request):
+    return request.client.host if request.client else "unknown"
+
+class RateLimiter:
+    def __init__(self, scope: str, limit: int, window_seconds: int, key_func=client_ip, detail=None, header_prefix="X-RateLimit"):
+        self.scope = scope
+        self.header_prefix = header_prefix
+        self.limit = limit
+        self.window_ms = window_seconds * 1000
+        self.key_func = key_func
+        self.detail = detail or "Rate limit exceeded. Try again later."
+        self.local = {}
+        self.lock = threading.Lock()
+
+    def _check_local(self, key, now_ms):
+        with self.lock:
+            if key not in self.local and len(self.local) >= LOCAL_MAX_KEYS:
+                self.local.clear()
+            hits = self.local.setdefault(key, deque())
+            while hits and hits[0] <= now_ms - self.window_ms:
+                hits.popleft()
+            allowed = len(hits) < self.limit
+            if allowed:
+                hits.append(now_ms)
+            reset = hits[0] + self.window_ms - now_ms if hits else self.window_ms
+            return RateLimitState(
+                allowed=allowed, limit=self.limit, remaining=self.limit - len(hits),
+                reset_seconds=reset / 1000, header_prefix=self.header_prefix,
+            )
+
+    def check(self, key: str):
+        now_ms = int(time.time() * 1000)
+        try:
+            allowed, remaining, reset = sliding_window(
+                keys=[f"ratelimit:{self.scope}:{key}"],
+                args=[now_ms, self.window_ms, self.limit, f"{now_ms}-{uuid.uuid4().hex[:8]}"],
+            )
+            return RateLimitState(
+                allowed=bool(allowed), limit=self.limit, remaining=int(remaining),
+                reset_seconds=int(reset) / 1000, header_prefix=self.header_prefix,
+            )
+        except redis.RedisError as e:
+            print(f"Rate limiter falling back to local window ({self.scope}):", e)
+            return self._check_local(key, now_ms)
+
+    # records a hit for this request, sets the quota headers and raises 429
+    # once the window is full
+    def enforce(self, request: Request, response: Response = None):
+        state = self.check(self.key_func(request))
+        if response is not None:
+            response.headers.update(state.headers())
+        if not state.allowed:
+            raise HTTPException(status_code=429, detail=self.detail, headers=state.headers())
+        return state
+
+    # usable directly as Depends(limiter) or in a route's dependencies=[...];
+    # routes returning their own Response (e.g. StreamingResponse) take the
+    # returned state and copy state.headers() onto it
+    def __call__(self, request: Request, response: Response):
+        return self.enforce(request, response)
+
+GUEST_LLM_LIMIT = int(os.getenv("GUEST_LLM_LIMIT", "4"))
+LLM_BURST_LIMIT = int(os.getenv("LLM_BURST_LIMIT", "20"))
+
+guest_llm_limiter = RateLimiter(
+    "anon-llm",
+    limit=GUEST_LLM_LIMIT,
+    window_seconds=86400,
+    detail="LLM limit reached for guest use. Log in for unlimited LLM usage!",
+)
+# per-IP burst protection on the LLM routes for everyone, logged in or not;
+# X-RateLimit-* stays the guest quota the frontend reads
+llm_burst_limiter = RateLimiter(
+    "llm-burst", limit=LLM_BURST_LIMIT, window_seconds=60, header_prefix="X-RateLimit-Burst"
+)
@@ -0,0 +1,169 @@
+# Incrementally maintained report counts (report_daily_counts, migration 0006).
+# Every upsert batch applies the difference between the rollup keys its
+# reports had before the write and the keys they have after it, inside the
+# same savepoint, so counts move with the raw rows. Keys whose counts drop to
+# zero are deleted. rebuild_rollups recomputes days still under partition
+# retention from test_reports: after backfills, after writes that bypass
+# bulk_insert, and for the recent window on every refresh to correct drift
+# from concurrent writers.
+#
+# `reports` counts raw rows; `events` counts cluster roots only, so each
+# near-duplicate cluster (app/dedupe.py) is counted once.
+#
+#   python -m app.rollups rebuild --days 2
+#   python -m app.rollups rebuild --since 2024-01-01 --until 2024-03-31
+import argparse
+import os
+from datetime import date, datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import text
+from app.db import engine
+from app.partitions import retention_cutoff
+
+load_dotenv()
+
+ROLLUP_RECONCILE_DAYS = int(os.getenv("ROLLUP_RECONCILE_DAYS", "2"))
+
+ROLLUP_KEY = """
+    (date_report_created AT TIME ZONE 'UTC')::date AS day, primary_country,
+    primary_country_shortname, country_lat, country_long,
+    COALESCE(disaster_type, '') AS disaster_type, COALESCE(disaster_status, '') AS disaster_status,
+    (COALESCE(cluster_id, report_id) = report_id)::int AS root
+"""
+
+# Must run before the rows in [lo, hi] are deleted/upserted: "old" reads the
+# stored versions of the staged reports, "new" the staged ones (the last copy
+# of each, as in the upsert). Unchanged reports never reach the stage. Returns
+# the keys whose count reached zero.
+APPLY_ROLLUP_DELTA = f"""
+    WITH staged AS (
+        SELECT DISTINCT ON (report_id) *
+        FROM staging_reports
+        WHERE seq BETWEEN :lo AND :hi
+        ORDER BY report_id, seq DESC
+    ),
+    changes AS (
+        SELECT {ROLLUP_KEY}, -1 AS delta
+        FROM test_reports
+        WHERE report_id IN (SELECT report_id FROM staged)
+        UNION ALL
+        SELECT {ROLLUP_KEY}, 1 AS delta
+        FROM staged
+    ),
+    delta AS (
+        SELECT day, primary_country, disaster_type, disaster_status,
+        MAX(primary_country_shortname) AS primary_country_shortname,
+        MAX(country_lat) AS country_lat, MAX(country_long) AS country_long,
+        SUM(delta) AS reports, SUM(delta * root) AS events
+        FROM changes
+        GROUP BY day, primary_country, disaster_type, disaster_status
+        HAVING SUM(delta) <> 0 OR SUM(delta * root) <> 0
+    )
+    INSERT INTO report_daily_counts (
+        day, primary_country, primary_country_shortname, country_lat, country_long,
+        disaster_type, disaster_status, reports, events
+    )
+    SELECT day, primary_country, primary_country_shortname, country_lat, country_long,
+    disaster_type, disaster_status, reports, events
+    FROM delta
+    ON CONFLICT (day, primary_country, disaster_type, disaster_status) DO UPDATE SET
+    reports = report_daily_counts.reports + EXCLUDED.reports,
+    events = report_daily_counts.events + EXCLUDED.events,
+    primary_country_shortname = COALESCE(EXCLUDED.primary_country_shortname, report_daily_counts.primary_country_shortname),
+    country_lat = COALESCE(EXCLUDED.country_lat, report_daily_counts.country_lat),
+    country_long = COALESCE(EXCLUDED.country_long, report_daily_counts.country_long)
+    RETURNING day, primary_country, disaster_type, disaster_status, reports;
+"""
+
+DELETE_EMPTY_ROLLUPS = """
+    DELETE FROM report_daily_counts c
+    USING unnest(CAST(:days AS DATE[]), CAST(:countries AS TEXT[]), CAST(:types AS TEXT[]), CAST(:statuses AS TEXT[]))
+        AS k(day, primary_country, disaster_type, disaster_status)
+    WHERE c.day = k.day AND c.primary_country = k.primary_country
+    AND c.disaster_type = k.disaster_type AND c.disaster_status = k.disaster_status
+    AND c.reports <= 0;
+"""
+
+DELETE_ROLLUPS_RANGE = "DELETE FROM report_daily_counts WHERE day BETWEEN :since AND :until;"
+
+# a concurrent ingest batch may re-create a key after the delete; the rebuilt
+# count wins and the next reconcile picks up anything it missed
+REBUILD_ROLLUPS_RANGE = """
+    INSERT INTO report_daily_counts (
+        day, primary_country, primary_country_shortname, country_lat, country_long,
+        disaster_type, disaster_status, reports, events
+    )
+    SELECT
+        (date_report_created AT TIME ZONE 'UTC')::date, primary_country,
+        MAX(primary_country_shortname), MAX(country_lat), MAX(country_long),
+        COALESCE(disaster_type, ''), COALESCE(disaster_status, ''), COUNT(*),
+        COUNT(*) FILTER (WHERE COALESCE(cluster_id, report_id) = report_id)
+    FROM test_reports
+    WHERE date_report_created >= CAST(:since AS DATE)::timestamp AT TIME ZONE 'UTC'
+    AND date_report_created < (CAST(:until AS DATE) + 1)::timestamp AT TIME ZONE 'UTC'
+    GROUP BY 1, 2, 6, 7
+    ON CONFLICT (day, primary_country, disaster_type, disaster_status) DO UPDATE SET
+    reports = EXCLUDED.reports, events = EXCLUDED.events;
+"""
+
+def apply_rollup_delta(conn, lo, hi):
+    touched = conn.execute(text(APPLY_ROLLUP_DELTA), {"lo": lo, "hi": hi}).all()
+    empty = [row for row in touched if row.reports <= 0]
+    if empty:
+        conn.execute(text(DELETE_EMPTY_ROLLUPS), {
+            "days": [row.day for row in empty],
+            "countries": [row.primary_country for row in empty],
+            "types": [row.disaster_type for row in empty],
+            "statuses": [row.disaster_status for row in empty],
+        })
+
+def as_day(value):
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).date() if value.tzinfo else value.date()
+    if isinstance(value, date):
+        return value
+    return as_day(datetime.fromisoformat(value))
+
+# Recomputes the counts for UTC days since..until (inclusive) from test_reports;
+# pass conn to run it in the caller's transaction. Days in months past
+# retention are left alone: their raw rows are gone (and re-ingesting them is
+# refused), so their counts are the only record left.
+def rebuild_rollups(since, until=None, conn=None):
+    since = as_day(since)
+    until = as_day(until) if until is not None else datetime.now(timezone.utc).date()
+    cutoff = retention_cutoff()
+    if cutoff is not None and since < cutoff:
+        if until < cutoff:
+            print(f"Skipped rollup rebuild for {since.isoformat()}..{until.isoformat()}: past retention")
+            return 0
+        since = cutoff
+    if conn is None:
+        with engine.begin() as conn:
+            return rebuild_rollups(since, until, conn)
+    conn.execute(text(DELETE_ROLLUPS_RANGE), {"since": since, "until": until})
+    rows = conn.execute(text(REBUILD_ROLLUPS_RANGE), {"since": since, "until": until}).rowcount
+    print(f"Rebuilt {rows} rollup rows for {since.isoformat()}..{until.isoformat()}")
+    return rows
+
+# the last `days` days (UTC), default ROLLUP_RECONCILE_DAYS
+def reconcile_recent_rollups(days=None, now=None):
+    days = ROLLUP_RECONCILE_DAYS if days is None else days
+    now = now or datetime.now(timezone.utc)
+    return rebuild_rollups(now - timedelta(days=days), now)
+
+def main():
+    parser = argparse.ArgumentParser(description="report_daily_counts maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--days", type=int, default=None)
+    parser.add_argument("--since", default=None, help="first UTC day (YYYY-MM-DD); overrides --days")
+    parser.add_argument("--until", default=None, help="last UTC day (YYYY-MM-DD), default today")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        if args.since:
+            rebuild_rollups(args.since, args.until)
+        else:
+            reconcile_recent_rollups(args.days)
+
+if __name__ == "__main__":
+    main()
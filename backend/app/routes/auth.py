@@ -3,10 +3,14 @@ from datetime import datetime, timedelta
 from app.db import engine, text, SessionLocal
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from dotenv import load_dotenv
 from pathlib import Path
+from collections import OrderedDict
 import requests
+import hashlib
+import threading
+import time
 import jwt
 import base64
 import os
@@ -38,8 +42,7 @@ def get_db():
 @router.get("/create-jwt")
 def create_jwt(user_email: str, db: Session = Depends(get_db)):
 
-    if not check_user_exists(user_email, db):
-        create_new_user(user_email, db)
+    upsert_user(user_email, db)
 
     expiration = datetime.utcnow() + timedelta(days=7)
     payload = {
@@ -49,6 +52,24 @@ def create_jwt(user_email: str, db: Session = Depends(get_db)):
 
     return jwt.encode(payload, PRIV_JWT_KEY, algorithm="RS256")
 
+# one round trip: inserts the user unless the unique email index already has it
+def upsert_user(user_email: str, db: Session):
+    upsert_query = text("""
+    INSERT INTO user_table (email, username, date_created)
+    VALUES (:user_email, :username, :date_created)
+    ON CONFLICT (email) DO NOTHING
+    RETURNING user_id;
+    """)
+
+    params = {
+        "user_email": user_email,
+        "username": user_email.split("@")[0],
+        "date_created": datetime.utcnow().isoformat()
+    }
+    created = db.execute(upsert_query, params).scalar()
+    db.commit()
+    return created is not None
+
 @router.get("/check-user-exists")
 def check_user_exists(user_email: str, db: Session = Depends(get_db)):
 
@@ -65,24 +86,11 @@ def check_user_exists(user_email: str, db: Session = Depends(get_db)):
 @router.get("/create-new-user")
 def create_new_user(user_email: str, db: Session = Depends(get_db)):
 
-    date_created = datetime.utcnow().isoformat()
-    username = user_email.split("@")[0]
-
-    insert_query = text("""
-    INSERT INTO user_table (email, username, date_created)  
-    VALUES (:user_email, :username, :date_created);
-    """)
-
-    params = {
-        "user_email": user_email,
-        "username": username,
-        "date_created": date_created
-    }
     try:
-        db.execute(insert_query, params)
-        db.commit()
-        return {"message": "User inserted!"}
-    
+        if upsert_user(user_email, db):
+            return {"message": "User inserted!"}
+        return {"message": "User already exists."}
+
     except Exception as e:
         return {"message" : e}
 
@@ -115,20 +123,57 @@ def auth_and_redirect(code: str, db: Session = Depends(get_db)):
 
     return payload
 
+# sha256(token) -> (exp, sub) for tokens whose signature already checked out.
+# A hit skips the RS256 verification but never outlives the token's own exp.
+verified_tokens = OrderedDict()
+verified_tokens_lock = threading.Lock()
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "10000"))
+
+def verify_token(token: str):
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
+
+    with verified_tokens_lock:
+        cached = verified_tokens.get(digest)
+        if cached is not None:
+            if cached[0] > now:
+                verified_tokens.move_to_end(digest)
+                return cached[1]
+            del verified_tokens[digest]
+
+    decoded_token = jwt.decode(
+        token,
+        key = PUBLIC_JWT_KEY,
+        algorithms="RS256",
+        options={"require": ["exp", "sub"]})
+
+    with verified_tokens_lock:
+        verified_tokens[digest] = (decoded_token["exp"], decoded_token["sub"])
+        verified_tokens.move_to_end(digest)
+        while len(verified_tokens) > VERIFIED_TOKEN_CACHE_SIZE:
+            verified_tokens.popitem(last=False)
+    return decoded_token["sub"]
+
+# reusable dependency for routes that need a logged-in user; returns their email
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    try:
+        return verify_token(token)
+    except jwt.InvalidTokenError:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"})
+
 @router.post("/validate-token")
 def validate_token(token_info: JWTModel):
 
     try:
-        decoded_token = jwt.decode(
-            token_info.token, 
-            key = PUBLIC_JWT_KEY, 
-            algorithms="RS256")
-
+        verify_token(token_info.token)
         return True
-    
+
     except jwt.ExpiredSignatureError:
         return False
-    
+
     except jwt.InvalidTokenError:
         return False
 
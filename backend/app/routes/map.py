@@ -0,0 +1,162 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import List, Optional
+from app.routes.routes import get_db, snapshot_response
+from app.snapshots import dumps, get_snapshot
+import base64
+
+router = APIRouter()
+
+# below this zoom the viewport is answered with grid-cell counts instead of events
+CLUSTER_MAX_ZOOM = 6
+# grid cells per 256px tile edge when clustering
+CLUSTER_CELLS_PER_TILE = 8
+MAX_VIEWPORT_EVENTS = 5000
+MAX_REPORT_IDS = 200
+MAX_REPORTS_PAGE = 100
+
+REPORT_DETAIL_COLUMNS = """
+    report_id, primary_country, primary_country_shortname, country_lat, country_long,
+    date_report_created, headline_title, headline_summary, source_name, source_homepage,
+    report_url_alias, disaster_id, disaster_name, disaster_type, disaster_status, cluster_id
+"""
+
+REPORTS_BY_ID_QUERY = f"""
+    SELECT {REPORT_DETAIL_COLUMNS}
+    FROM test_reports
+    WHERE report_id = ANY(:report_ids)
+    ORDER BY date_report_created DESC, report_id DESC;
+"""
+
+# keyset pagination: (date, id) is unique, so the next page starts strictly
+# after the last row of this one without an OFFSET scan
+REPORTS_PAGE_QUERY = f"""
+    SELECT {REPORT_DETAIL_COLUMNS}
+    FROM test_reports
+    WHERE (CAST(:cursor_date AS TIMESTAMPTZ) IS NULL
+           OR (date_report_created, report_id) < (CAST(:cursor_date AS TIMESTAMPTZ), :cursor_id))
+    ORDER BY date_report_created DESC, report_id DESC
+    LIMIT :limit;
+"""
+
+# the box is compared in planar lon/lat (geography edges would bend along great
+# circles on world-wide views); a box that crosses the antimeridian (west > east)
+# is split into two envelopes
+VIEWPORT_FILTER = """
+    (geom::geometry && ST_MakeEnvelope(:west, :south, :east, :north, 4326)
+     OR (:wraps AND geom::geometry && ST_MakeEnvelope(:west2, :south, :east2, :north, 4326)))
+    AND date_report_created >= :since
+"""
+
+VIEWPORT_EVENTS_QUERY = f"""
+    SELECT report_id, country_lat AS lat, country_long AS long, headline_title,
+    date_report_created, disaster_type
+    FROM test_reports
+    WHERE {VIEWPORT_FILTER}
+    ORDER BY date_report_created DESC
+    LIMIT :limit;
+"""
+
+VIEWPORT_CLUSTERS_QUERY = f"""
+    SELECT AVG(country_lat) AS lat, AVG(country_long) AS long, COUNT(*) AS count,
+    MAX(date_report_created) AS latest
+    FROM test_reports
+    WHERE {VIEWPORT_FILTER}
+    GROUP BY ST_SnapToGrid(geom::geometry, :cell_size)
+    ORDER BY count DESC;
+"""
+
+def viewport_params(west, south, east, north, days):
+    params = {
+        "west": west, "south": south, "east": east, "north": north,
+        "wraps": False, "west2": -180.0, "east2": 180.0,
+        "since": datetime.utcnow() - timedelta(days=days),
+    }
+    if west > east:
+        params.update({"east": 180.0, "wraps": True, "west2": -180.0, "east2": east})
+    return params
+
+# Events inside the visible bounding box. At low zoom the response is clustered
+# server-side into grid cells sized to the zoom level, so the payload grows
+# with what's on screen rather than with the table.
+@router.get("/events/viewport")
+def events_in_viewport(
+    west: float = Query(..., ge=-180, le=180),
+    south: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    zoom: int = Query(..., ge=0, le=22),
+    days: int = Query(21, ge=1, le=365),
+    db: Session = Depends(get_db),
+):
+    if south > north:
+        raise HTTPException(status_code=400, detail="south must be <= north")
+
+    params = viewport_params(west, south, east, north, days)
+
+    if zoom <= CLUSTER_MAX_ZOOM:
+        params["cell_size"] = 360.0 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+        rows = db.execute(text(VIEWPORT_CLUSTERS_QUERY), params).fetchall()
+        payload = {"type": "clusters", "zoom": zoom, "clusters": [dict(r._mapping) for r in rows]}
+    else:
+        params["limit"] = MAX_VIEWPORT_EVENTS
+        rows = db.execute(text(VIEWPORT_EVENTS_QUERY), params).fetchall()
+        payload = {
+            "type": "events",
+            "zoom": zoom,
+            "truncated": len(rows) == MAX_VIEWPORT_EVENTS,
+            "events": [dict(r._mapping) for r in rows],
+        }
+
+    return Response(content=dumps(payload), media_type="application/json")
+
+# slim markers (id, coords, title, date, disaster type) for the last 21 days,
+# served from the snapshot published after each ingestion run; collapse=true
+# keeps one marker per near-duplicate cluster, with a `duplicates` count
+@router.get("/events/markers")
+def event_markers(request: Request, collapse: bool = False, db: Session = Depends(get_db)):
+    return snapshot_response(request, get_snapshot("markers-collapsed" if collapse else "markers", db))
+
+def encode_cursor(date_report_created: datetime, report_id: int):
+    raw = f"{date_report_created.isoformat()}|{report_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        date, report_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(date), int(report_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Full report details. Either a batch of ids (one query, e.g. for the markers
+# a user clicked) or newest-first pages walked with the returned next_cursor.
+@router.get("/reports")
+def get_reports(
+    ids: Optional[List[int]] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_REPORTS_PAGE),
+    db: Session = Depends(get_db),
+):
+    if ids:
+        if len(ids) > MAX_REPORT_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_REPORT_IDS} ids per request")
+        rows = db.execute(text(REPORTS_BY_ID_QUERY), {"report_ids": ids}).fetchall()
+        payload = {"reports": [dict(r._mapping) for r in rows]}
+        return Response(content=dumps(payload), media_type="application/json")
+
+    cursor_date, cursor_id = decode_cursor(cursor) if cursor else (None, 0)
+    rows = db.execute(
+        text(REPORTS_PAGE_QUERY),
+        {"cursor_date": cursor_date, "cursor_id": cursor_id, "limit": limit},
+    ).fetchall()
+
+    reports = [dict(r._mapping) for r in rows]
+    next_cursor = None
+    if len(reports) == limit:
+        last = reports[-1]
+        next_cursor = encode_cursor(last["date_report_created"], last["report_id"])
+    payload = {"reports": reports, "next_cursor": next_cursor}
+    return Response(content=dumps(payload), media_type="application/json")
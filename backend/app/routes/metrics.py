@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from app.db import engine, get_async_engine
+from app.metrics import ScrapeTimeCollector
+from app.routes.routes import redis_client
+from app.llm_cache import redis_client as cache_redis_client
+from app.snapshots import redis_bytes
+
+router = APIRouter()
+
+REGISTRY.register(ScrapeTimeCollector(
+    engines={"sync": engine, "async": get_async_engine()},
+    redis_clients={"routes": redis_client, "llm_cache": cache_redis_client, "snapshots": redis_bytes},
+))
+
+# API metrics plus the worker metrics aggregated in Redis, in the Prometheus
+# text format
+@router.get("/metrics")
+def metrics():
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
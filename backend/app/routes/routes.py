@@ -1,15 +1,24 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi import APIRouter, Depends, Request, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlalchemy import text
 from sqlalchemy.orm import Session
-from app.db import SessionLocal
-from datetime import datetime, timedelta
-from app.llm_chain import generate
-from collections import defaultdict
+from app.db import SessionLocal, get_async_engine
+from app.llm_chain import agenerate
+from app.llm_cache import get_cached_sql, cache_sql, get_cached_rows, cache_rows, cache_stats, json_default
+from app.rate_limit import RateLimitState, guest_llm_limiter, llm_burst_limiter
+from app.sql_guard import prepare_generated_sql, guard_transaction, record_timing, UnsafeQueryError, QueryTooExpensiveError
+from app.question_index import find_similar_sql, remember_question
+from app.snapshots import get_snapshot, build_initial_events_json, build_collapsed_events_json
 from dotenv import load_dotenv
 from sqlalchemy.exc import DBAPIError
 import traceback
+import time
+import gzip
 import redis
+import json
+import orjson
 import os
 
 load_dotenv()
@@ -19,6 +28,9 @@ router = APIRouter()
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
 
+STREAM_BATCH_ROWS = 100
+STREAM_CACHE_MAX_ROWS = 5000
+
 class LLMInput(BaseModel):
     user_input: str
     loggedIn: bool
@@ -47,66 +59,158 @@ def get_last_updated_time(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Unexpected error")
 
 
-@router.post("/llm-response")
-def process_prompt(input: LLMInput, request: Request, db:Session=Depends(get_db)):
+def guarded_sql(response: dict):
+    try:
+        return prepare_generated_sql(response.get("sql").replace("%%", "%"))
+    except UnsafeQueryError as e:
+        raise HTTPException(status_code=400, detail=f"Generated query rejected: {e}")
+
+# cached SQL, then a near-duplicate question, then the LLM. The Redis lookups
+# are sync, so they run off the event loop; only the LLM call is awaited.
+async def resolve_sql(user_input: str):
+    response = await run_in_threadpool(get_cached_sql, user_input)
+    if response is None:
+        response = await run_in_threadpool(find_similar_sql, user_input)
+        if response is None:
+            response = await agenerate(user_input)
+            await run_in_threadpool(remember_question, user_input, response)
+        await run_in_threadpool(cache_sql, user_input, response)
+    return response
+
+@router.post("/llm-response", dependencies=[Depends(llm_burst_limiter)])
+async def process_prompt(input: LLMInput, request: Request, response: Response):
 
     if not input.loggedIn:
-        client_ip = request.client.host
-        key = f"anon-llm:{client_ip}"
-        count = redis_client.get(key)
-        if count and int(count) >= 4:
-            raise HTTPException(status_code=429, detail="LLM limit reached for guest use. Log in for unlimited LLM usage!")
-        else:
-            redis_client.incr(key)
-            redis_client.expire(key, 86400)
+        quota = await run_in_threadpool(guest_llm_limiter.enforce, request, response)
 
     user_input = input.user_input
-    response = generate(user_input)
-    query = response.get("sql").replace("%%", "%")
+    generated = await resolve_sql(user_input)
+    query = guarded_sql(generated)
     print("query!", query)
-    rows = db.execute(text(query))
-    col = rows.keys()
-    
-    result = [dict(zip(col, row)) for row in rows.fetchall()]
+
+    result = await run_in_threadpool(get_cached_rows, query)
+    if result is None:
+        started = time.perf_counter()
+        try:
+            async with get_async_engine().connect() as conn:
+                async with conn.begin():
+                    cost = await guard_transaction(conn, query)
+                    rows = await conn.execute(text(query))
+                    col = rows.keys()
+                    result = [dict(zip(col, row)) for row in rows.fetchall()]
+        except QueryTooExpensiveError as e:
+            raise HTTPException(status_code=422, detail=f"Generated query is too expensive: {e}")
+        except DBAPIError as e:
+            detail = str(e.orig) if hasattr(e, "orig") else str(e)
+            raise HTTPException(status_code=400, detail=f"Generated query failed: {detail}")
+        await run_in_threadpool(record_timing, query, started, len(result), cost)
+        await run_in_threadpool(cache_rows, query, result)
+
     if not input.loggedIn:
-        return {"prompt_results": result, "sql": query, "attempts_left": 4 - int(redis_client.get(key))}
-    
-    return {"prompt_results": result, "sql": query}
-        
-@router.get("/grab-initial-events")
-def grab_initial_events(db: Session = Depends(get_db)):
+        return {"prompt_results": result, "sql": query, "attempts_left": quota.remaining}
 
-    three_weeks_ago = (datetime.utcnow() - timedelta(days=21)).isoformat()
-    print(three_weeks_ago)
+    return {"prompt_results": result, "sql": query}
 
-    query = text(f"""
-    SELECT report_id, primary_country, country_lat, country_long, date_report_created, 
-    headline_title, headline_summary, source_name, source_homepage, 
-    report_url_alias FROM test_reports 
-    WHERE date_report_created >= :three_weeks_ago ORDER BY date_report_created DESC;
-    """
-    )
+def ndjson_line(payload: dict):
+    return orjson.dumps(payload, default=json_default) + b"\n"
 
-    rows = db.execute(query, {"three_weeks_ago": three_weeks_ago}).fetchall()
+# Same pipeline as /llm-response, streamed as NDJSON: a "sql" line as soon as
+# the query is known, then "rows" batches as the server-side cursor yields
+# them, then a "done" line with the row count.
+@router.post("/llm-response/stream")
+async def process_prompt_stream(input: LLMInput, request: Request, burst: RateLimitState = Depends(llm_burst_limiter)):
 
-    grouped = defaultdict(list)
+    quota = None
+    if not input.loggedIn:
+        quota = await run_in_threadpool(guest_llm_limiter.enforce, request)
 
-    for row in rows:
-        report = dict(row._mapping)
-        country_lat, country_long = report.get('country_lat'), report.get('country_long')
+    response = await resolve_sql(input.user_input)
+    query = guarded_sql(response)
 
-        key = (country_lat, country_long)
-        grouped[key].append(report)
+    async def stream():
+        yield ndjson_line({"type": "sql", "sql": query, "highlight_condition": response.get("highlight_condition")})
 
-    result = []
-    for key, reports in grouped.items():
-        result.append({
-            "lat": key[0],
-            "long": key[1],
-            "reports": reports
-        })
+        count = 0
+        cached = await run_in_threadpool(get_cached_rows, query)
+        if cached is not None:
+            for i in range(0, len(cached), STREAM_BATCH_ROWS):
+                yield ndjson_line({"type": "rows", "rows": cached[i:i + STREAM_BATCH_ROWS]})
+            count = len(cached)
+        else:
+            # keep a copy for the rows cache unless the result turns out too big to cache
+            collected = []
+            started = time.perf_counter()
+            try:
+                async with get_async_engine().connect() as conn:
+                    async with conn.begin():
+                        cost = await guard_transaction(conn, query)
+                        result = await conn.stream(text(query))
+                        col = list(result.keys())
+                        async for partition in result.partitions(STREAM_BATCH_ROWS):
+                            rows = [dict(zip(col, row)) for row in partition]
+                            count += len(rows)
+                            if collected is not None:
+                                collected.extend(rows)
+                                if count > STREAM_CACHE_MAX_ROWS:
+                                    collected = None
+                            yield ndjson_line({"type": "rows", "rows": rows})
+            except QueryTooExpensiveError as e:
+                yield ndjson_line({"type": "error", "detail": f"Generated query is too expensive: {e}"})
+                return
+            except DBAPIError as e:
+                yield ndjson_line({"type": "error", "detail": str(getattr(e, "orig", e))})
+                return
+            await run_in_threadpool(record_timing, query, started, count, cost)
+            if collected is not None:
+                await run_in_threadpool(cache_rows, query, collected)
+
+        done = {"type": "done", "count": count}
+        if quota is not None:
+            done["attempts_left"] = quota.remaining
+        yield ndjson_line(done)
+
+    # a StreamingResponse doesn't inherit headers set on the injected Response
+    headers = burst.headers()
+    if quota is not None:
+        headers.update(quota.headers())
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers=headers)
+
+def etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+def gzip_response(request: Request, body: bytes, headers: dict):
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=body, media_type="application/json", headers=headers)
+    return Response(content=gzip.decompress(body), media_type="application/json", headers=headers)
+
+def snapshot_response(request: Request, snapshot: dict):
+    headers = {
+        "ETag": snapshot["etag"],
+        "Cache-Control": "no-cache",
+        "X-Snapshot-Version": str(snapshot["version"]),
+    }
+    if etag_matches(request, snapshot["etag"]):
+        return Response(status_code=304, headers=headers)
+    return gzip_response(request, snapshot["body"], headers)
+
+# served from the snapshot published after each ingestion run
+# collapse=true returns one report per near-duplicate cluster, each with a
+# duplicate_count of the copies left out
+@router.get("/grab-initial-events")
+def grab_initial_events(request: Request, collapse: bool = False, db: Session = Depends(get_db)):
+    name = "initial-events-collapsed" if collapse else "initial-events"
+    return snapshot_response(request, get_snapshot(name, db))
 
-    return result
+# bypasses the snapshot; postgres builds the grouped JSON on every call
+@router.get("/grab-initial-events/live")
+def grab_initial_events_live(collapse: bool = False, db: Session = Depends(get_db)):
+    body = build_collapsed_events_json(db) if collapse else build_initial_events_json(db)
+    return Response(content=body, media_type="application/json")
 
 @router.get("/ping")
 def ping():
@@ -127,9 +231,14 @@ def redis_check():
 def get_last_refresh_run():
     try:
         last = redis_client.get("last_refresh_db")
-        if last:
-            return {"last_refresh_run": last}
-        return {"last_refresh_run": None}
+        stats = redis_client.get("last_refresh_stats")
+        return {
+            "last_refresh_run": last or None,
+            "last_refresh_stats": json.loads(stats) if stats else None
+        }
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
+@router.get("/llm-cache-stats")
+def get_llm_cache_stats():
+    return cache_stats()
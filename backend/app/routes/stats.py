@@ -0,0 +1,98 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+from app.routes.routes import get_db
+from app.snapshots import dumps
+from app.llm_chain import REGION_MAP, region_countries
+
+router = APIRouter()
+
+MAX_STATS_DAYS = 3660
+
+# group_by values mapped to the report_daily_counts columns they select; the
+# country group also carries the coordinates so results can go on the map
+STATS_GROUPS = {
+    "day": ["day"],
+    "country": ["primary_country", "primary_country_shortname", "country_lat", "country_long"],
+    "disaster_type": ["disaster_type"],
+    "disaster_status": ["disaster_status"],
+}
+STATS_GROUP_KEYS = {"country": ["primary_country"]}
+
+STATS_FILTER = """
+    day BETWEEN :since AND :until
+    AND (CAST(:countries AS TEXT[]) IS NULL
+         OR primary_country = ANY(:countries) OR primary_country_shortname = ANY(:countries))
+    AND (CAST(:disaster_type AS TEXT) IS NULL OR disaster_type = :disaster_type)
+    AND (CAST(:status AS TEXT) IS NULL OR disaster_status = :status)
+"""
+
+def stats_query(group_by):
+    selected = [col for group in group_by for col in STATS_GROUPS[group]]
+    keys = [col for group in group_by for col in STATS_GROUP_KEYS.get(group, STATS_GROUPS[group])]
+    columns = [
+        col if col in keys else f"MAX({col}) AS {col}"
+        for col in selected
+    ]
+    grouping = f"GROUP BY {', '.join(keys)}" if keys else ""
+    return f"""
+        SELECT {', '.join(columns + ['SUM(reports) AS reports', 'SUM(events) AS events'])}
+        FROM report_daily_counts
+        WHERE {STATS_FILTER}
+        {grouping}
+        ORDER BY {'reports DESC' if 'day' not in keys else 'day, reports DESC'};
+    """
+
+# Report counts from the report_daily_counts rollup, which bulk_insert keeps
+# current, so the cost depends on the days and groups asked for rather than on
+# the size of test_reports. `reports` counts raw reports, `events` counts each
+# near-duplicate cluster once. Unknown disaster types/statuses are grouped as "".
+@router.get("/stats")
+def get_stats(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    country: Optional[List[str]] = Query(None),
+    region: Optional[str] = None,
+    disaster_type: Optional[str] = None,
+    status: Optional[str] = None,
+    group_by: List[str] = Query(["country"]),
+    db: Session = Depends(get_db),
+):
+    unknown = [group for group in group_by if group not in STATS_GROUPS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by: {', '.join(unknown)}")
+    group_by = list(dict.fromkeys(group_by))
+
+    until = until or datetime.utcnow().date()
+    since = since or until - timedelta(days=30)
+    if since > until:
+        raise HTTPException(status_code=400, detail="since must be <= until")
+    if (until - since).days > MAX_STATS_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_STATS_DAYS} days per request")
+
+    countries = list(country or [])
+    if region:
+        if region.lower() not in REGION_MAP:
+            raise HTTPException(status_code=400, detail=f"Unknown region: {region}")
+        countries.extend(region_countries(region.lower()))
+
+    rows = db.execute(text(stats_query(group_by)), {
+        "since": since,
+        "until": until,
+        "countries": countries or None,
+        "disaster_type": disaster_type,
+        "status": status,
+    }).fetchall()
+
+    stats = [dict(r._mapping) for r in rows]
+    payload = {
+        "since": since,
+        "until": until,
+        "group_by": group_by,
+        "total": sum(row["reports"] for row in stats),
+        "total_events": sum(row["events"] for row in stats),
+        "stats": stats,
+    }
+    return Response(content=dumps(payload), media_type="application/json")
@@ -0,0 +1,192 @@
+import gzip
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+import orjson
+import redis
+from dotenv import load_dotenv
+from sqlalchemy import text
+from app.db import engine
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# snapshot bodies are gzip bytes, so this client must not decode responses
+redis_bytes = redis.Redis.from_url(REDIS_URL)
+
+INITIAL_EVENTS_DAYS = 21
+# a snapshot older than the refresh interval (3h) means ingestion has stalled;
+# readers then rebuild it so the 21-day window keeps moving
+SNAPSHOT_MAX_AGE_SECONDS = int(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", str(3 * 3600)))
+SNAPSHOT_REBUILD_LOCK_SECONDS = 60
+
+# one row per near-duplicate cluster in the window (see app/dedupe.py): its
+# newest report, with the number of other reports in the cluster. Used in
+# place of test_reports by the collapsed snapshots.
+COLLAPSED_REPORTS = """(
+        SELECT DISTINCT ON (cluster_key) *
+        FROM (
+            SELECT *, COALESCE(cluster_id, report_id) AS cluster_key,
+            COUNT(*) OVER (PARTITION BY COALESCE(cluster_id, report_id)) - 1 AS duplicate_count
+            FROM test_reports
+            WHERE date_report_created >= :three_weeks_ago
+        ) clustered
+        ORDER BY cluster_key, date_report_created DESC, report_id DESC
+    ) AS test_reports"""
+
+# One entry per (lat, long) with every report there, grouped and encoded by
+# postgres (bench/bench_initial_events.py keeps the python-grouped reference):
+# locations ordered by their newest report, reports newest first. Returns the
+# JSON document as bytes so it never round-trips through python objects.
+INITIAL_EVENTS_JSON_TEMPLATE = """
+    SELECT COALESCE(
+        json_agg(
+            json_build_object('lat', loc.lat, 'long', loc.long, 'reports', loc.reports)
+            ORDER BY loc.latest DESC
+        ),
+        '[]'::json
+    )::text
+    FROM (
+        SELECT country_lat AS lat, country_long AS long,
+        MAX(date_report_created) AS latest,
+        json_agg(
+            json_build_object(
+                'report_id', report_id,
+                'primary_country', primary_country,
+                'country_lat', country_lat,
+                'country_long', country_long,
+                'date_report_created', date_report_created,
+                'headline_title', headline_title,
+                'headline_summary', headline_summary,
+                'source_name', source_name,
+                'source_homepage', source_homepage,
+                'report_url_alias', report_url_alias{extra}
+            )
+            ORDER BY date_report_created DESC
+        ) AS reports
+        FROM {source}
+        WHERE date_report_created >= :three_weeks_ago
+        GROUP BY country_lat, country_long
+    ) loc;
+"""
+
+INITIAL_EVENTS_JSON_QUERY = INITIAL_EVENTS_JSON_TEMPLATE.format(source="test_reports", extra="")
+COLLAPSED_EVENTS_JSON_QUERY = INITIAL_EVENTS_JSON_TEMPLATE.format(
+    source=COLLAPSED_REPORTS, extra=",\n                'duplicate_count', duplicate_count"
+)
+
+def dumps(payload):
+    return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+
+def _three_weeks_ago():
+    return (datetime.utcnow() - timedelta(days=INITIAL_EVENTS_DAYS)).isoformat()
+
+def build_initial_events_json(conn):
+    body = conn.execute(text(INITIAL_EVENTS_JSON_QUERY), {"three_weeks_ago": _three_weeks_ago()}).scalar()
+    return body.encode("utf-8")
+
+MARKERS_JSON_TEMPLATE = """
+    SELECT COALESCE(
+        json_agg(
+            json_build_object(
+                'id', report_id,
+                'lat', country_lat,
+                'long', country_long,
+                'title', headline_title,
+                'date', date_report_created,
+                'disaster_type', disaster_type{extra}
+            )
+            ORDER BY date_report_created DESC
+        ),
+        '[]'::json
+    )::text
+    FROM {source}
+    WHERE date_report_created >= :three_weeks_ago;
+"""
+
+MARKERS_JSON_QUERY = MARKERS_JSON_TEMPLATE.format(source="test_reports", extra="")
+COLLAPSED_MARKERS_JSON_QUERY = MARKERS_JSON_TEMPLATE.format(
+    source=COLLAPSED_REPORTS, extra=",\n                'duplicates', duplicate_count"
+)
+
+# map markers without bodies; details are loaded per click through /reports
+def build_markers_json(conn):
+    body = conn.execute(text(MARKERS_JSON_QUERY), {"three_weeks_ago": _three_weeks_ago()}).scalar()
+    return body.encode("utf-8")
+
+# one entry per near-duplicate cluster, each with its duplicate count
+def build_collapsed_events_json(conn):
+    body = conn.execute(text(COLLAPSED_EVENTS_JSON_QUERY), {"three_weeks_ago": _three_weeks_ago()}).scalar()
+    return body.encode("utf-8")
+
+def build_collapsed_markers_json(conn):
+    body = conn.execute(text(COLLAPSED_MARKERS_JSON_QUERY), {"three_weeks_ago": _three_weeks_ago()}).scalar()
+    return body.encode("utf-8")
+
+SNAPSHOT_BUILDERS = {
+    "initial-events": build_initial_events_json,
+    "markers": build_markers_json,
+    "initial-events-collapsed": build_collapsed_events_json,
+    "markers-collapsed": build_collapsed_markers_json,
+}
+
+# Builds the payload, gzips it once and stores body + version + etag together
+# in one Redis hash so readers never see a body from one version with the etag
+# of another.
+def publish_snapshot(name, conn=None):
+    builder = SNAPSHOT_BUILDERS[name]
+    if conn is None:
+        with engine.connect() as conn:
+            raw = builder(conn)
+    else:
+        raw = builder(conn)
+
+    body = gzip.compress(raw, compresslevel=6)
+    snapshot = {
+        "body": body,
+        "etag": f'"{hashlib.sha1(raw).hexdigest()[:20]}"',
+        "version": 0,
+        "built_at": int(time.time()),
+    }
+    try:
+        snapshot["version"] = redis_bytes.incr(f"snapshot:{name}:version")
+        redis_bytes.hset(f"snapshot:{name}", mapping=snapshot)
+        print(f"Published {name} snapshot v{snapshot['version']} ({len(body)} bytes).")
+    except redis.RedisError as e:
+        print(f"Failed to publish {name} snapshot:", e)
+    return snapshot
+
+# called at the end of each ingestion run
+def publish_all_snapshots():
+    with engine.connect() as conn:
+        for name in SNAPSHOT_BUILDERS:
+            publish_snapshot(name, conn)
+
+# only one reader rebuilds a stale snapshot; the others keep serving it
+def _claim_rebuild(name):
+    try:
+        return bool(redis_bytes.set(f"snapshot:{name}:rebuilding", 1, nx=True, ex=SNAPSHOT_REBUILD_LOCK_SECONDS))
+    except redis.RedisError:
+        return False
+
+# Serves the stored snapshot, rebuilding it from `conn` if it's missing, older
+# than SNAPSHOT_MAX_AGE_SECONDS, or Redis can't be reached.
+def get_snapshot(name, conn):
+    try:
+        stored = redis_bytes.hgetall(f"snapshot:{name}")
+    except redis.RedisError as e:
+        print(f"Failed to read {name} snapshot:", e)
+        stored = None
+
+    if stored and b"body" in stored:
+        snapshot = {
+            "body": stored[b"body"],
+            "etag": stored[b"etag"].decode("utf-8"),
+            "version": int(stored[b"version"]),
+        }
+        built_at = int(stored.get(b"built_at", 0))
+        if time.time() - built_at <= SNAPSHOT_MAX_AGE_SECONDS or not _claim_rebuild(name):
+            return snapshot
+        print(f"{name} snapshot is {int(time.time() - built_at)}s old, rebuilding.")
+    return publish_snapshot(name, conn)
@@ -0,0 +1,85 @@
+# Execution guardrails for LLM-generated SQL. Generated queries only ever run
+# as a single read-only statement with a statement_timeout, are rejected when
+# EXPLAIN estimates them above LLM_SQL_MAX_COST, and are capped at
+# LLM_SQL_ROW_CAP rows when they don't already carry a smaller LIMIT.
+import json
+import os
+import re
+import time
+import redis
+from dotenv import load_dotenv
+from sqlalchemy import text
+from app.llm_cache import redis_client, sha1_hex
+from app.metrics import generated_sql_seconds
+
+load_dotenv()
+
+SQL_TIMEOUT_MS = int(os.getenv("LLM_SQL_TIMEOUT_MS", "5000"))
+SQL_MAX_COST = float(os.getenv("LLM_SQL_MAX_COST", "500000"))
+SQL_ROW_CAP = int(os.getenv("LLM_SQL_ROW_CAP", "2000"))
+TIMINGS_KEY = "llm-sql:timings"
+TIMINGS_KEPT = 1000
+
+FORBIDDEN = re.compile(
+    r"\b(insert|update|delete|merge|drop|alter|create|truncate|grant|revoke|copy|vacuum|"
+    r"call|do|set|reset|lock|listen|notify|prepare|execute|refresh|comment|security)\b",
+    re.IGNORECASE,
+)
+TRAILING_LIMIT = re.compile(r"\blimit\s+(\d+)(\s+offset\s+\d+)?\s*$", re.IGNORECASE)
+
+class UnsafeQueryError(ValueError):
+    pass
+
+class QueryTooExpensiveError(ValueError):
+    pass
+
+def _strip_literals(sql):
+    # keywords inside string literals ('Fire', 'Drop in cases') aren't statements
+    return re.sub(r"'(?:[^']|'')*'", "''", sql)
+
+# Validates the shape of a generated query and returns it with a row cap.
+def prepare_generated_sql(sql: str):
+    sql = sql.strip().rstrip(";").strip()
+    bare = _strip_literals(sql)
+    if ";" in bare:
+        raise UnsafeQueryError("Only a single statement is allowed")
+    if not re.match(r"^(select|with)\b", bare, re.IGNORECASE):
+        raise UnsafeQueryError("Only SELECT queries are allowed")
+    if FORBIDDEN.search(bare):
+        raise UnsafeQueryError("Query contains a statement that isn't allowed")
+
+    limit = TRAILING_LIMIT.search(bare)
+    if limit is None:
+        return f"SELECT * FROM ({sql}) AS capped LIMIT {SQL_ROW_CAP}"
+    if int(limit.group(1)) > SQL_ROW_CAP:
+        start, end = limit.span(1)
+        offset = len(sql) - len(bare)
+        return sql[:start + offset] + str(SQL_ROW_CAP) + sql[end + offset:]
+    return sql
+
+# Must be the first thing run inside the transaction that executes `sql`:
+# makes it read-only, applies the timeout and checks the planner's estimate.
+async def guard_transaction(conn, sql: str):
+    await conn.execute(text("SET TRANSACTION READ ONLY"))
+    await conn.execute(text(f"SET LOCAL statement_timeout = {SQL_TIMEOUT_MS}"))
+    plan = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    cost = plan[0]["Plan"]["Total Cost"]
+    if cost > SQL_MAX_COST:
+        raise QueryTooExpensiveError(f"Estimated cost {cost:.0f} exceeds limit {SQL_MAX_COST:.0f}")
+    return cost
+
+def record_timing(sql: str, started: float, rows: int, cost: float):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    generated_sql_seconds.observe(elapsed_ms / 1000)
+    entry = {"sql": sha1_hex(sql), "ms": round(elapsed_ms, 1), "rows": rows, "cost": cost, "at": time.time()}
+    print(f"Generated SQL ran in {elapsed_ms:.1f}ms ({rows} rows, cost {cost:.0f})")
+    try:
+        pipe = redis_client.pipeline()
+        pipe.lpush(TIMINGS_KEY, json.dumps(entry))
+        pipe.ltrim(TIMINGS_KEY, 0, TIMINGS_KEPT - 1)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    return elapsed_ms
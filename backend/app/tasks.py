@@ -1,14 +1,25 @@
-import requests
 from sqlalchemy import create_engine, text
-from celery import Celery
+from celery import Celery, chain, chord, group
+from celery.signals import task_prerun, task_postrun, task_failure
 from dotenv import load_dotenv
 import redis
+import requests
+import json
 import os
+import time
 from celery.schedules import crontab
 from datetime import datetime, timedelta, timezone
-from urllib.parse import urlencode
-from app.db_models.worldevent import ReportData
 from app.db import engine
+from app.bulk_insert import bulk_upsert_reports, to_payload
+from app.snapshots import publish_all_snapshots
+from app.llm_cache import bump_data_version
+from app.fetcher import fetch_page, parse_report, parse_reports, iter_report_pages, iter_streamed_reports, iter_batches
+from app.archive import archived_windows, iter_archived_reports
+from app.rate_limit import RateLimiter
+from app.partitions import maintain_partitions
+from app.dedupe import prune_signatures
+from app.rollups import rebuild_rollups, reconcile_recent_rollups
+from app.metrics import ingest_stage_seconds, ingest_reports, celery_task_seconds, celery_task_failures, report_partition_events
 
 load_dotenv()
 
@@ -19,6 +30,17 @@ app = Celery("tasks", broker=REDIS_URL, backend=REDIS_URL)
 
 appname = "atlascope"
 
+DEFAULT_REFRESH_HOURS = 4
+REFRESH_OVERLAP = timedelta(minutes=int(os.getenv("REFRESH_OVERLAP_MINUTES", "30")))
+# pages fetched/inserted concurrently per wave of the ingest pipeline
+PIPELINE_MAX_IN_FLIGHT = int(os.getenv("PIPELINE_MAX_IN_FLIGHT", "4"))
+# default ingest mode for refresh_db/backfill: "chord", "pages", "stream" or "replay"
+INGEST_MODE = os.getenv("INGEST_MODE", "chord")
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "200"))
+# 0 disables the backfill throttle
+BACKFILL_PAGES_PER_MINUTE = int(os.getenv("BACKFILL_PAGES_PER_MINUTE", "0"))
+backfill_throttle = RateLimiter("backfill", limit=max(BACKFILL_PAGES_PER_MINUTE, 1), window_seconds=60)
+
 '''
 @app.on_after_configure.connect
 def setup_periodic_data_refresh(sender: Celery, **kwargs):
@@ -28,222 +50,227 @@ def setup_periodic_data_refresh(sender: Celery, **kwargs):
         refresh_db.s()
     )
 '''
-@app.task
+def as_datetime(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+# returns compact rows (see bulk_insert.to_payload) so results can travel
+# through the broker as plain JSON
+@app.task(autoretry_for=(requests.RequestException,), retry_backoff=True, max_retries=3)
 def fetch_reports(start, end, offset = 0, limit = 1000):
+    data = fetch_page(as_datetime(start), as_datetime(end), offset=offset, limit=limit)
+    return [to_payload(r) for r in parse_reports(data.get("data"))]
 
-    params = {
-        "appname": "atlascope",
-        "filter[conditions][0][field]": "date.created",
-        "filter[conditions][0][value][from]": start.isoformat(),
-        "filter[conditions][0][value][to]": end.isoformat(),
-        "sort[]": "date.created:desc",
-        "fields[include][]": [
-            "disaster", 
-            "body",
-            "id",
-            "primary_country", 
-            "source", 
-            "source.type.name",
-            "date", 
-            "language", 
-            "url_alias"
-        ],
-        "limit": limit,
-        "offset": offset
-    }
-
-    base_url = "https://api.reliefweb.int/v1/reports"
-    encoded_params = urlencode(params, doseq=True)
-    full_url = f"{base_url}?{encoded_params}"
-
-    res = requests.get(full_url)
-    data = res.json()
-    data = data.get("data")
-
-    results = []
-    for report in data:
-        report_id = int(report.get("id", None))
-        if not report_id:
-            continue
-        fields = report.get("fields")
-        language = fields.get("language", [])[0].get("name", None)
-        if language != "English":
-            continue
-        country_data = fields.get("primary_country", {})
-        primary_country = country_data.get("name")
-        if primary_country == "World":
-            continue
-        headline_title = fields.get("title", None)
-        if "Location Map" in headline_title or "Monthly Snapshot" in headline_title:
-            continue
-        country_lat = country_data.get("location", {}).get("lat", None)
-        country_long = country_data.get("location", {}).get("lon", None)
-        if not country_lat or not country_long:
-            continue
-        disaster_data = fields.get("disaster", [])
-        disaster_status = disaster_data[0].get("status", None) if disaster_data else None
-        if disaster_status and disaster_status == "past":
-            continue
-        disaster_id = disaster_data[0].get("id", None) if disaster_data else None
-        disaster_name = disaster_data[0].get("name", None) if disaster_data else None
-        disaster_glide = disaster_data[0].get("glide", None) if disaster_data else None
-        disaster_type = disaster_data[0].get("type", [])[0].get("name", None) if disaster_data else None
-        primary_country_iso3 = country_data.get("iso3")
-        primary_country_shortname = country_data.get("shortname", None)
-        date = fields.get("date",{}).get("created", None)
-        date_report_created = datetime.fromisoformat(date)
-        
-        headline_summary = fields.get("body", None)
-        source_name = fields.get("source", [])[0].get("shortname", None)
-        source_homepage = fields.get("source", [])[0].get("homepage", None)
-        report_url_alias = fields.get("url_alias", None)
-        
-        report = ReportData(
-            report_id = report_id,
-            primary_country = primary_country,
-            primary_country_iso3 = primary_country_iso3,
-            primary_country_shortname = primary_country_shortname,
-            country_lat = country_lat,
-            country_long = country_long,
-            date_report_created = date_report_created,
-            headline_title = headline_title,
-            headline_summary = headline_summary,
-            language = language,
-            source_name = source_name,
-            source_homepage = source_homepage,
-            report_url_alias = report_url_alias,
-            disaster_id = disaster_id,
-            disaster_name = disaster_name,
-            disaster_glide = disaster_glide,
-            disaster_type = disaster_type,
-            disaster_status = disaster_status
-        )
-        results.append(report)
-    
-    return results
+# Task timings for /metrics, pushed from the worker through Redis (see app/metrics.py).
+task_started = {}
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    task_started[task_id] = time.perf_counter()
+
+@task_postrun.connect
+def stop_task_timer(task_id=None, task=None, state=None, **kwargs):
+    started = task_started.pop(task_id, None)
+    if started is not None and task is not None:
+        celery_task_seconds.observe(time.perf_counter() - started, task=task.name, state=state or "")
+
+@task_failure.connect
+def count_task_failure(sender=None, **kwargs):
+    celery_task_failures.inc(getattr(sender, "name", "unknown"))
 
 @app.task
 def fetch_insert_db(reports):
-    initial_query = """
-        CREATE TABLE IF NOT EXISTS test_reports (
-        report_id INTEGER PRIMARY KEY,
-        primary_country TEXT NOT NULL,
-        primary_country_iso3 TEXT NOT NULL,
-        primary_country_shortname TEXT,
-        country_lat REAL NOT NULL,
-        country_long REAL NOT NULL,
-        geom GEOGRAPHY(Point, 4326),
-        date_report_created TIMESTAMP WITH TIME ZONE NOT NULL,
-        headline_title TEXT,
-        headline_summary TEXT,
-        language TEXT,
-        source_name TEXT,
-        source_homepage TEXT,
-        report_url_alias TEXT,
-        disaster_id INTEGER,
-        disaster_name TEXT,
-        disaster_glide TEXT,
-        disaster_type TEXT,
-        disaster_status TEXT
-        );
-    """
+    started = time.perf_counter()
+    stats = bulk_upsert_reports(reports)
+    ingest_stage_seconds.observe(time.perf_counter() - started, stage="upsert")
+    ingest_reports.inc_many(stats)
+    print(
+        f"Batch upsert: {stats['new']} new, {stats['changed']} changed, "
+        f"{stats['unchanged']} unchanged, {stats['failed']} failed."
+    )
+    return stats
 
-    insert_query = """
-        INSERT INTO test_reports 
-        (report_id, primary_country, primary_country_iso3, primary_country_shortname,
-        country_lat, country_long, geom, date_report_created, headline_title, headline_summary, 
-        language, source_name, source_homepage, report_url_alias, disaster_id, disaster_name, 
-        disaster_glide, disaster_type, disaster_status) 
-        VALUES (
-        :report_id, :primary_country, :primary_country_iso3, 
-        :primary_country_shortname,:country_lat, :country_long, 
-        ST_SetSRID(ST_MakePoint(:country_long, :country_lat), 4326),
-        :date_report_created, :headline_title, :headline_summary, 
-        :language, :source_name, :source_homepage, :report_url_alias, 
-        :disaster_id, :disaster_name, :disaster_glide, :disaster_type, 
-        :disaster_status
-        )
-        ON CONFLICT (report_id) DO UPDATE SET 
-        primary_country = EXCLUDED.primary_country,
-        primary_country_iso3 = EXCLUDED.primary_country_iso3,
-        primary_country_shortname = EXCLUDED.primary_country_shortname,
-        country_lat = EXCLUDED.country_lat,
-        country_long = EXCLUDED.country_long,
-        date_report_created = EXCLUDED.date_report_created,
-        headline_title = EXCLUDED.headline_title,
-        headline_summary = EXCLUDED.headline_summary,
-        language = EXCLUDED.language,
-        source_name = EXCLUDED.source_name,
-        source_homepage = EXCLUDED.source_homepage,
-        report_url_alias = EXCLUDED.report_url_alias,
-        disaster_id = EXCLUDED.disaster_id,
-        disaster_name = EXCLUDED.disaster_name,
-        disaster_glide = EXCLUDED.disaster_glide,
-        disaster_type = EXCLUDED.disaster_type,
-        disaster_status = EXCLUDED.disaster_status
-    ;
-    """
+def add_stats(total, stats):
+    for key, value in stats.items():
+        total[key] = total.get(key, 0) + value
+    return total
 
-    count = 0
-    with engine.connect() as cursor:
-        cursor.execute(text(initial_query))
-        cursor.commit()
-        print("Test Reports table created.")
-        for r in reports:
-            params = {
-                "report_id": r.report_id,
-                "primary_country": r.primary_country,
-                "primary_country_iso3": r.primary_country_iso3,
-                "primary_country_shortname": r.primary_country_shortname,
-                "country_lat": r.country_lat,
-                "country_long": r.country_long,
-                "date_report_created": r.date_report_created,
-                "headline_title": r.headline_title,
-                "headline_summary": r.headline_summary,
-                "language": r.language,
-                "source_name": r.source_name,
-                "source_homepage": r.source_homepage,
-                "report_url_alias": r.report_url_alias,
-                "disaster_id": r.disaster_id,
-                "disaster_name": r.disaster_name,
-                "disaster_glide": r.disaster_glide,
-                "disaster_type": r.disaster_type,
-                "disaster_status": r.disaster_status
-            }
-            try:
-                cursor.execute(text(insert_query), params)             
-                cursor.commit()
-                count += 1
-            except Exception as e:
-                print(e)
+# start of the next refresh window: the last successful refresh minus a small
+# overlap for reports ReliefWeb indexes late, or the old fixed window on first run
+def get_refresh_start(now):
+    try:
+        last = redis_client.get("last_refresh_db")
+    except Exception as e:
+        print("Failed to read last_refresh_db:", e)
+        last = None
+
+    if not last:
+        return now - timedelta(hours=DEFAULT_REFRESH_HOURS)
+    start = datetime.fromisoformat(last) - REFRESH_OVERLAP
+    return min(start, now)
+
+# Plans every page across the given (start, end) windows and hands them to
+# run_ingest_wave. A limit=1 request per window is enough to read totalCount.
+@app.task
+def plan_ingest(windows, run_at, mark_refresh=False, limit=1000, max_pages=1000):
+    pages = []
+    for start, end in windows:
+        first = fetch_page(as_datetime(start), as_datetime(end), offset=0, limit=1, archive=False)
+        total = min(int(first.get("totalCount") or 0), limit * max_pages)
+        pages.extend([start, end, offset] for offset in range(0, total, limit))
+
+    print(f"Planned {len(pages)} pages across {len(windows)} windows")
+    return run_ingest_wave([], {}, pages, run_at, mark_refresh, limit)
+
+# Dispatches the next PIPELINE_MAX_IN_FLIGHT pages as a chord of
+# fetch_reports -> fetch_insert_db chains; the chord calls back into this task
+# with the batch stats, so at most one wave of pages is in flight at a time.
+@app.task
+def run_ingest_wave(results, totals, pages, run_at, mark_refresh, limit=1000):
+    for stats in results or []:
+        add_stats(totals, stats)
+
+    if not pages:
+        finish_ingest.delay(totals, run_at, mark_refresh)
+        return totals
+
+    wave, rest = pages[:PIPELINE_MAX_IN_FLIGHT], pages[PIPELINE_MAX_IN_FLIGHT:]
+    header = group(
+        chain(fetch_reports.si(start, end, offset, limit), fetch_insert_db.s())
+        for start, end, offset in wave
+    )
+    chord(header)(run_ingest_wave.s(totals, rest, run_at, mark_refresh, limit))
+    return totals
+
+# only reached once every batch in every wave has committed
+@app.task
+def finish_ingest(totals, run_at, mark_refresh):
+    print(f"Ingest totals: {totals}")
+    try:
+        bump_data_version()
+    except Exception as e:
+        print("Failed to bump data version:", e)
+    try:
+        publish_all_snapshots()
+    except Exception as e:
+        print("Failed to rebuild snapshots:", e)
+    if not mark_refresh:
+        return totals
+    try:
+        redis_client.set("last_refresh_db", run_at)
+        redis_client.set("last_refresh_stats", json.dumps({"run_at": run_at, **totals}))
+    except Exception as e:
+        print("Failed to update last_refresh_db:", e)
+    return totals
+
+# Streaming alternative to the chord pipeline: reports are parsed off the
+# response as it arrives and written in fixed-size batches, so peak memory is
+# bounded by STREAM_BATCH_SIZE instead of page limit x body length.
+@app.task
+def stream_ingest(windows, run_at, mark_refresh=False, limit=1000, batch_size=None):
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    totals = {}
+    for start, end in windows:
+        reports = iter_streamed_reports(as_datetime(start), as_datetime(end), limit=limit)
+        for batch in iter_batches(reports, batch_size):
+            add_stats(totals, fetch_insert_db(batch))
+    return finish_ingest(totals, run_at, mark_refresh)
+
+# In-process alternative to the chord for a single worker: pages are fetched
+# concurrently (at most RELIEFWEB_CONCURRENCY in flight) by iter_report_pages
+# and inserted in offset order as they arrive.
+@app.task
+def pages_ingest(windows, run_at, mark_refresh=False, limit=1000):
+    totals = {}
+    for start, end in windows:
+        for _, reports in iter_report_pages(as_datetime(start), as_datetime(end), limit=limit):
+            if reports:
+                add_stats(totals, fetch_insert_db(reports))
+    return finish_ingest(totals, run_at, mark_refresh)
+
+# Replays archived raw pages (see app/archive.py) overlapping the given
+# windows through the same parse and insert stages, without the network.
+@app.task
+def replay_ingest(windows, run_at, mark_refresh=False, batch_size=None):
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    totals = {}
+    replayed = set()
+    for start, end in windows:
+        for _, _, path in archived_windows(as_datetime(start), as_datetime(end)):
+            if path in replayed:
                 continue
-    print(f"Succesfully inserted {count} reports into DB.")
+            replayed.add(path)
+            print(f"Replaying {path.name}")
+            parsed = (parse_report(raw) for raw in iter_archived_reports(path))
+            reports = (r for r in parsed if r is not None)
+            for batch in iter_batches(reports, batch_size):
+                add_stats(totals, fetch_insert_db(batch))
+    return finish_ingest(totals, run_at, mark_refresh)
+
+# re-ingests the whole local archive, or the part of it overlapping [start, end]
+@app.task
+def replay_archive(start=None, end=None):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    return replay_ingest([[start, end]], now.isoformat())
+
+# "chord" fans pages out over workers, "pages" fetches pages concurrently
+# in-process, "stream" parses and inserts in-process one page at a time with
+# bounded memory, "replay" reads the local page archive instead of the API
+def run_ingest(windows, run_at, mark_refresh=False, mode=None):
+    mode = mode or INGEST_MODE
+    if mode == "replay":
+        # archived data says nothing about what the API has now, so it never
+        # moves the refresh watermark
+        return replay_ingest(windows, run_at)
+    if mode == "pages":
+        return pages_ingest(windows, run_at, mark_refresh=mark_refresh)
+    if mode == "stream":
+        return stream_ingest(windows, run_at, mark_refresh=mark_refresh)
+    plan_ingest.delay(windows, run_at, mark_refresh=mark_refresh)
 
 # Refreshes the DB every 3 hours with new reports/events
 @app.task
-def refresh_db():
+def refresh_db(mode=None):
     now = datetime.now(timezone.utc).replace(microsecond=0)
-    start = now - timedelta(hours=4)
-    total_requests = 0
-    offset = 0
-    limit = 1000
-    max_requests = 1000
-
-    while total_requests < max_requests:
-        print(f"Fetching offset {offset}")
-        reports = fetch_reports(start = start, end = now, offset = offset, limit = limit)
-        if not reports:
-            break
-        fetch_insert_db(reports)
-        if len(reports) < limit:
-            break
-        offset += limit
-        total_requests += 1
-        
+    start = get_refresh_start(now)
+    windows = [[start.isoformat(), now.isoformat()]]
+
+    print(f"Refreshing reports created between {start.isoformat()} and {now.isoformat()}")
+    maintain_report_partitions()
+    prune_report_signatures()
+    reconcile_rollups()
+    run_ingest(windows, now.isoformat(), mark_refresh=True, mode=mode)
+
+# creates upcoming monthly partitions and detaches/drops months past
+# REPORT_RETENTION_MONTHS; runs before every refresh
+@app.task
+def maintain_report_partitions():
     try:
-        redis_client.set("last_refresh_db", now.isoformat())
+        return maintain_partitions()
     except Exception as e:
-        print("Failed to update last_refresh_db:", e)
+        report_partition_events.inc("failed")
+        print("Partition maintenance failed:", e)
+        return None
+
+# forgets near-duplicate signatures older than DEDUPE_WINDOW_DAYS
+@app.task
+def prune_report_signatures():
+    try:
+        return prune_signatures()
+    except Exception as e:
+        print("Signature pruning failed:", e)
+        return None
+
+# recomputes the last ROLLUP_RECONCILE_DAYS of report_daily_counts from
+# test_reports, correcting drift from overlapping ingest batches
+@app.task
+def reconcile_rollups():
+    try:
+        return reconcile_recent_rollups()
+    except Exception as e:
+        print("Rollup reconciliation failed:", e)
+        return None
 
 @app.task
 def test_add(name: str):
@@ -268,30 +295,111 @@ def test_table_clear():
 
 # one time run for cron issues
 @app.task
-def backfill_last_5_days():
+def backfill_last_5_days(mode=None):
     print("Starting backfill for past 5 days...")
     now = datetime.now(timezone.utc).replace(microsecond=0)
     days_to_backfill = 5
 
+    windows = []
     for day_offset in range(days_to_backfill, 0, -1):
         start = now - timedelta(days=day_offset)
         end = start + timedelta(days=1)
-        offset = 0
-        limit = 1000
-        max_requests = 1000
-        total_requests = 0
+        windows.append([start.isoformat(), end.isoformat()])
+
+    run_ingest(windows, now.isoformat(), mode=mode)
+    print("Backfill started.")
+
+def partition_range(start, end, unit="day"):
+    step = timedelta(hours=1) if unit == "hour" else timedelta(days=1)
+    partitions = []
+    cursor = start
+    while cursor < end:
+        partitions.append([cursor.isoformat(), min(cursor + step, end).isoformat()])
+        cursor += step
+    return partitions
+
+def backfill_job_key(start, end, unit):
+    return f"backfill:{start.isoformat()}:{end.isoformat()}:{unit}"
 
-        print(f"Backfilling reports for {start.date()}...")
+# waits for a page slot when BACKFILL_PAGES_PER_MINUTE is set; the window is
+# shared through Redis, so the throttle holds across all workers
+def throttle_backfill():
+    if not BACKFILL_PAGES_PER_MINUTE:
+        return
+    while True:
+        state = backfill_throttle.check("pages")
+        if state.allowed:
+            return
+        time.sleep(max(state.reset_seconds, 0.1))
+
+# One partition of a backfill. Progress is checkpointed in the job's Redis
+# hash after every committed page (next offset to fetch, or "done"), so a
+# retried or re-dispatched partition picks up where it stopped.
+@app.task(acks_late=True, autoretry_for=(requests.RequestException,), retry_backoff=True, max_retries=5)
+def backfill_partition(job_key, start, end, limit=1000, max_pages=1000):
+    checkpoint = redis_client.hget(job_key, start)
+    if checkpoint == "done":
+        return {}
+    offset = int(checkpoint or 0)
+
+    totals = {}
+    for _ in range(max_pages):
+        throttle_backfill()
+        data = fetch_page(as_datetime(start), as_datetime(end), offset=offset, limit=limit)
+        raw = data.get("data") or []
+        reports = parse_reports(raw)
+        if reports:
+            add_stats(totals, fetch_insert_db(reports))
+        offset += limit
+        if len(raw) < limit or offset >= int(data.get("totalCount") or 0):
+            redis_client.hset(job_key, start, "done")
+            return totals
+        redis_client.hset(job_key, start, offset)
+
+    # out of pages with data left: the offset checkpoint stays, so re-running
+    # backfill_range resumes this partition instead of skipping it
+    print(f"Backfill {job_key}: partition {start} stopped at offset {offset} (max_pages reached)")
+    return totals
+
+# Parallel partitions can count a report twice in the rollups, and a month
+# detached by retention has no stored rows to subtract, so the backfilled days
+# are recomputed from test_reports once every partition is in.
+@app.task
+def finish_backfill(results, job_key, run_at, start=None, end=None):
+    totals = {}
+    for stats in results or []:
+        add_stats(totals, stats)
+    print(f"Backfill {job_key} finished.")
+    if start and end:
+        try:
+            rebuild_rollups(start, end)
+        except Exception as e:
+            print("Rollup rebuild after backfill failed:", e)
+    return finish_ingest(totals, run_at, False)
+
+# Backfills any [start, end] range split into day or hour partitions that run
+# in parallel across workers. Re-running the same range resumes it: finished
+# partitions are skipped and the rest continue from their checkpoints.
+@app.task
+def backfill_range(start, end, unit="day"):
+    start, end = as_datetime(start), as_datetime(end)
+    job_key = backfill_job_key(start, end, unit)
+    checkpoints = redis_client.hgetall(job_key)
 
-        while total_requests < max_requests:
-            reports = fetch_reports(start=start, end=end, offset=offset, limit=limit)
-            if not reports:
-                break
-            fetch_insert_db(reports)
-            if len(reports) < limit:
-                break
-            offset += limit
-            total_requests += 1
+    pending = [p for p in partition_range(start, end, unit) if checkpoints.get(p[0]) != "done"]
+    print(f"Backfill {job_key}: {len(pending)} partitions pending")
+    if not pending:
+        return job_key
 
-    print("Backfill complete.")
+    run_at = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+    header = group(backfill_partition.s(job_key, p_start, p_end) for p_start, p_end in pending)
+    chord(header)(finish_backfill.s(job_key, run_at, start.isoformat(), end.isoformat()))
+    return job_key
 
+def backfill_status(start, end, unit="day"):
+    start, end = as_datetime(start), as_datetime(end)
+    checkpoints = redis_client.hgetall(backfill_job_key(start, end, unit))
+    partitions = partition_range(start, end, unit)
+    done = sum(1 for p in partitions if checkpoints.get(p[0]) == "done")
+    in_progress = sum(1 for p in partitions if p[0] in checkpoints and checkpoints[p[0]] != "done")
+    return {"partitions": len(partitions), "done": done, "in_progress": in_progress}
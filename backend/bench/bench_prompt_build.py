@@ -0,0 +1,59 @@
+# Per-request overhead of turning a question into a rendered prompt, before
+# and after the chain was built once at import. No LLM call is made:
+#
+#   OPENAI_API_KEY=unused python -m bench.bench_prompt_build --iterations 2000
+#
+# Prints one JSON object with the mean microseconds per request for each path.
+import argparse
+import json
+import time
+from langchain_core.prompts import PromptTemplate
+from app.llm_chain import REGION_MAP, PROMPT_TEMPLATE, llm, parser, prompt, chain_input
+
+QUESTIONS = [
+    "floods in Brazil",
+    "How many earthquakes happened in Asia this month?",
+    "show wildfires within 200km of Athens",
+    "disasters in south america and africa in the last 7 days",
+]
+
+# the pre-change path: rebuild the whole prompt string, substring-scan it for
+# regions, and build a new template and chain for every request
+def legacy_request(user_input):
+    text = PROMPT_TEMPLATE.replace("{user_question}{region_notes}", user_input)
+    lowered = text.lower()
+    for region, countries in REGION_MAP.items():
+        if region in lowered:
+            text += f" (Note: {region.title()} includes {', '.join(countries)})"
+    template = PromptTemplate(template=text)
+    chain = template | llm | parser
+    return chain.first.invoke(user_input)
+
+def current_request(user_input):
+    return prompt.invoke(chain_input(user_input))
+
+def mean_us(fn, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(QUESTIONS[i % len(QUESTIONS)])
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def main():
+    cli = argparse.ArgumentParser()
+    cli.add_argument("--iterations", type=int, default=2000)
+    args = cli.parse_args()
+
+    for fn in (legacy_request, current_request):
+        fn(QUESTIONS[0])
+
+    legacy = mean_us(legacy_request, args.iterations)
+    current = mean_us(current_request, args.iterations)
+    print(json.dumps({
+        "iterations": args.iterations,
+        "legacy_us_per_request": round(legacy, 1),
+        "current_us_per_request": round(current, 1),
+        "speedup": round(legacy / current, 2) if current else None,
+    }))
+
+if __name__ == "__main__":
+    main()
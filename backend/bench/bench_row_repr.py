@@ -0,0 +1,126 @@
+# Per-report CPU and memory cost of the ingest path before and after reports
+# became ReportRow tuples validated a page at a time. Uses synthetic pages
+# (bench/synthetic.py) and needs no database or network:
+#
+#   python -m bench.bench_row_repr --reports 20000
+#
+# Prints one JSON object with CPU microseconds per report for each stage and
+# the memory held by one parsed page, for both paths.
+import argparse
+import hashlib
+import json
+import math
+import time
+import tracemalloc
+from datetime import datetime
+from app.bulk_insert import REPORT_COLUMNS, REQUIRED_TEXT, INT_COLUMNS, prepare_rows, to_payload
+from app.db_models.worldevent import ReportData
+from app.fetcher import parse_report
+from bench.synthetic import make_reports
+
+# the pre-change path: a pydantic ReportData built straight from the raw
+# report, copied back into a dict for the Celery payload and again for
+# validation
+def legacy_parse(raw):
+    return parse_report(raw, row_type=ReportData)
+
+def legacy_payload(report):
+    r = dict(report)
+    row = []
+    for col in REPORT_COLUMNS:
+        value = r.get(col)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        row.append(value)
+    return row
+
+# the hash the legacy path stored: sha1 of the row as JSON
+def legacy_content_hash(row):
+    payload = json.dumps(row, default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def legacy_prepare_row(report):
+    r = dict(zip(REPORT_COLUMNS, report))
+    row = []
+    for col in REPORT_COLUMNS:
+        value = r.get(col)
+        if col in INT_COLUMNS:
+            value = int(value) if value is not None else None
+        elif col in ("country_lat", "country_long"):
+            value = float(value) if value is not None else None
+            if value is None or math.isnan(value):
+                raise ValueError(f"missing {col}")
+        elif col == "date_report_created":
+            if isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            if not isinstance(value, datetime):
+                raise ValueError("missing date_report_created")
+        else:
+            value = str(value).replace("\x00", "") if value is not None else None
+        row.append(value)
+    values = dict(zip(REPORT_COLUMNS, row))
+    if not values["report_id"]:
+        raise ValueError("missing report_id")
+    for col in REQUIRED_TEXT:
+        if not values[col]:
+            raise ValueError(f"missing {col}")
+    if not -90 <= values["country_lat"] <= 90 or not -180 <= values["country_long"] <= 180:
+        raise ValueError("coordinates out of range")
+    row.append(legacy_content_hash(row))
+    return row
+
+def current_parse(raw):
+    return parse_report(raw)
+
+def current_prepare(payload):
+    return prepare_rows(payload, {"failed": 0})
+
+def legacy_prepare(payload):
+    return [legacy_prepare_row(row) for row in payload]
+
+def cpu_us_per_report(fn, items, count):
+    started = time.process_time()
+    result = fn(items)
+    return (time.process_time() - started) / count * 1e6, result
+
+# bytes still allocated after parsing one page and keeping the results
+def page_bytes(parse, page):
+    tracemalloc.start()
+    kept = [r for r in (parse(raw) for raw in page) if r is not None]
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return held, len(kept)
+
+def run_path(parse, to_row, prepare, reports, limit):
+    parse_us, parsed = cpu_us_per_report(lambda items: [r for r in map(parse, items) if r is not None], reports, len(reports))
+    payload_us, payload = cpu_us_per_report(lambda items: [to_row(r) for r in items], parsed, len(parsed))
+    prepare_us, _ = cpu_us_per_report(prepare, payload, len(payload))
+    held, kept = page_bytes(parse, reports[:limit])
+    return {
+        "parse_us_per_report": round(parse_us, 2),
+        "payload_us_per_report": round(payload_us, 2),
+        "validate_us_per_report": round(prepare_us, 2),
+        "total_us_per_report": round(parse_us + payload_us + prepare_us, 2),
+        "page_bytes_per_report": round(held / kept) if kept else None,
+    }
+
+def main():
+    cli = argparse.ArgumentParser()
+    cli.add_argument("--reports", type=int, default=20000)
+    cli.add_argument("--limit", type=int, default=1000)
+    args = cli.parse_args()
+
+    reports = make_reports(args.reports)
+    run_path(current_parse, to_payload, current_prepare, reports[:args.limit], args.limit)
+
+    legacy = run_path(legacy_parse, legacy_payload, legacy_prepare, reports, args.limit)
+    current = run_path(current_parse, to_payload, current_prepare, reports, args.limit)
+    print(json.dumps({
+        "reports": args.reports,
+        "legacy": legacy,
+        "current": current,
+        "speedup": round(legacy["total_us_per_report"] / current["total_us_per_report"], 2),
+    }))
+
+if __name__ == "__main__":
+    main()
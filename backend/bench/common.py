@@ -0,0 +1,41 @@
+# Helpers shared by the benchmark scripts.
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from app.db import connection_string
+
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1", "db", "postgres", "postgis"}
+
+# The database benchmarks write synthetic reports into test_reports, so they
+# refuse to run against anything but a local database unless told otherwise.
+def require_local_database(allow_remote=False):
+    host = urlparse(connection_string).hostname or "localhost"
+    if host not in LOCAL_HOSTS and not allow_remote:
+        sys.exit(f"Refusing to benchmark against {host}; point DATABASE_CONN_STRING at a local PostGIS or pass --allow-remote")
+
+def latency_summary(timings_ms):
+    ordered = sorted(timings_ms)
+    return {
+        "requests": len(ordered),
+        "p50_ms": round(statistics.median(ordered), 2),
+        "p95_ms": round(ordered[max(int(len(ordered) * 0.95 + 0.5) - 1, 0)], 2),
+        "mean_ms": round(statistics.fmean(ordered), 2),
+        "max_ms": round(ordered[-1], 2),
+    }
+
+def run_metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+    }
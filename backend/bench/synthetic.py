@@ -0,0 +1,171 @@
+# Synthetic ReliefWeb payloads with the field shapes parse_report reads, plus
+# a local stub of the reports API that serves them, so ingestion can be
+# benchmarked without the network. Roughly matches the live feed's mix: most
+# reports are English with one disaster, some have none or several, bodies
+# range from a sentence to several thousand words, and a share of rows is
+# there only to be filtered out (non-English, "World", map products, past
+# disasters).
+import json
+import random
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# (name, iso3, shortname, lat, lon)
+COUNTRIES = [
+    ("Sudan", "sdn", "Sudan", 15.5, 30.0),
+    ("South Sudan", "ssd", "South Sudan", 7.3, 30.3),
+    ("Democratic Republic of the Congo", "cod", "DR Congo", -2.9, 23.6),
+    ("Ukraine", "ukr", "Ukraine", 48.9, 31.4),
+    ("Syrian Arab Republic", "syr", "Syria", 35.0, 38.5),
+    ("Occupied Palestinian Territory", "pse", "oPt", 31.9, 35.2),
+    ("Afghanistan", "afg", "Afghanistan", 33.9, 67.7),
+    ("Bangladesh", "bgd", "Bangladesh", 23.7, 90.4),
+    ("Philippines", "phl", "Philippines", 12.9, 121.8),
+    ("Haiti", "hti", "Haiti", 19.0, -72.3),
+    ("Brazil", "bra", "Brazil", -14.2, -51.9),
+    ("Mexico", "mex", "Mexico", 23.6, -102.6),
+    ("Türkiye", "tur", "Türkiye", 39.0, 35.2),
+    ("Somalia", "som", "Somalia", 5.2, 46.2),
+    ("Mozambique", "moz", "Mozambique", -18.7, 35.5),
+    ("Myanmar", "mmr", "Myanmar", 21.9, 95.9),
+]
+WORLD = ("World", "wld", "World", None, None)
+
+DISASTER_TYPES = ["Flood", "Epidemic", "Earthquake", "Tropical Cyclone", "Drought", "Wild Fire", "Complex Emergency"]
+LANGUAGES = ["English"] * 17 + ["French", "Spanish", "Arabic"]
+SOURCES = [
+    ("OCHA", "https://www.unocha.org"),
+    ("UNICEF", "https://www.unicef.org"),
+    ("WFP", "https://www.wfp.org"),
+    ("IFRC", "https://www.ifrc.org"),
+    ("MSF", "https://www.msf.org"),
+]
+WORDS = (
+    "humanitarian partners continue to respond to needs across affected districts "
+    "access remains constrained while displacement increases and funding gaps persist "
+    "health water sanitation shelter food security protection education logistics"
+).split()
+
+def make_body(rng):
+    # log-normal length: mostly a few hundred words, with a long tail
+    words = min(int(rng.lognormvariate(5.5, 1.0)), 8000)
+    paragraphs = []
+    while words > 0:
+        n = min(words, rng.randint(40, 120))
+        paragraphs.append(" ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + ".")
+        words -= n
+    return "\n\n".join(paragraphs)
+
+def make_report(report_id, rng, created):
+    country = WORLD if rng.random() < 0.04 else rng.choice(COUNTRIES)
+    name, iso3, shortname, lat, lon = country
+    primary_country = {"name": name, "iso3": iso3, "shortname": shortname}
+    if lat is not None:
+        primary_country["location"] = {"lat": lat, "lon": lon}
+
+    disasters = []
+    for _ in range(rng.choices([0, 1, 2, 3], weights=[25, 60, 10, 5])[0]):
+        dtype = rng.choice(DISASTER_TYPES)
+        disaster_id = rng.randint(50000, 53000)
+        disasters.append({
+            "id": disaster_id,
+            "name": f"{shortname}: {dtype} - {created.year}",
+            "glide": f"{dtype[:2].upper()}-{created.year}-{disaster_id:06d}-{iso3.upper()}",
+            "status": rng.choices(["current", "alert", "past"], weights=[80, 10, 10])[0],
+            "type": [{"name": dtype}],
+        })
+
+    kind = rng.random()
+    if kind < 0.03:
+        title = f"{shortname}: Location Map"
+    elif kind < 0.05:
+        title = f"{shortname} Monthly Snapshot"
+    else:
+        topic = disasters[0]["type"][0]["name"] if disasters else "Humanitarian situation"
+        title = f"{shortname}: {topic} - Situation Report No. {rng.randint(1, 60)}"
+
+    source = rng.sample(SOURCES, rng.choices([1, 2, 3], weights=[80, 15, 5])[0])
+    return {
+        "id": report_id,
+        "score": 1,
+        "href": f"https://api.reliefweb.int/v1/reports/{report_id}",
+        "fields": {
+            "id": report_id,
+            "title": title,
+            "body": make_body(rng),
+            "language": [{"id": 267, "name": rng.choice(LANGUAGES), "code": "en"}],
+            "primary_country": primary_country,
+            "disaster": disasters,
+            "source": [
+                {"id": i, "name": s[0], "shortname": s[0], "homepage": s[1], "type": {"name": "International Organization"}}
+                for i, s in enumerate(source)
+            ],
+            "date": {"created": created.isoformat(), "changed": created.isoformat(), "original": created.isoformat()},
+            "url_alias": f"https://reliefweb.int/report/{iso3}/synthetic-{report_id}",
+        },
+    }
+
+# `count` reports, newest first, spread evenly over the `days` before `end`
+def make_reports(count, seed=0, first_id=4_000_000, days=30, end=None):
+    rng = random.Random(seed)
+    end = end or datetime.now(timezone.utc).replace(microsecond=0)
+    step = timedelta(days=days) / max(count, 1)
+    return [make_report(first_id + i, rng, end - step * i) for i in range(count)]
+
+def make_page(reports, offset, limit):
+    page = reports[offset:offset + limit]
+    return {"totalCount": len(reports), "count": len(page), "data": page}
+
+# Serves `reports` as the ReliefWeb reports endpoint, honouring offset/limit.
+# Pages are encoded once up front so the stub doesn't dominate the timings.
+class StubReliefWeb:
+    def __init__(self, reports, limit=1000):
+        self.reports = reports
+        self.limit = limit
+        self.pages = {
+            offset: json.dumps(make_page(reports, offset, limit)).encode("utf-8")
+            for offset in range(0, max(len(reports), 1), limit)
+        }
+        self.empty = json.dumps(make_page(reports, len(reports), limit)).encode("utf-8")
+        self.requests = 0
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                offset = int(query.get("offset", ["0"])[0])
+                limit = int(query.get("limit", [str(stub.limit)])[0])
+                stub.requests += 1
+                if limit == stub.limit:
+                    body = stub.pages.get(offset, stub.empty)
+                else:
+                    body = json.dumps(make_page(stub.reports, offset, limit)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+@contextmanager
+def serve(reports, limit=1000):
+    stub = StubReliefWeb(reports, limit)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stub.handler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/v1/reports", stub
+    finally:
+        server.shutdown()
+        server.server_close()
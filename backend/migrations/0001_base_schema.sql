@@ -0,0 +1,36 @@
+-- Tables the app reads and writes. Everything is IF NOT EXISTS so this also
+-- adopts databases created by the old inline CREATE TABLE in fetch_insert_db.
+CREATE EXTENSION IF NOT EXISTS postgis;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS test_reports (
+    report_id INTEGER PRIMARY KEY,
+    primary_country TEXT NOT NULL,
+    primary_country_iso3 TEXT NOT NULL,
+    primary_country_shortname TEXT,
+    country_lat REAL NOT NULL,
+    country_long REAL NOT NULL,
+    geom GEOGRAPHY(Point, 4326),
+    date_report_created TIMESTAMP WITH TIME ZONE NOT NULL,
+    headline_title TEXT,
+    headline_summary TEXT,
+    language TEXT,
+    source_name TEXT,
+    source_homepage TEXT,
+    report_url_alias TEXT,
+    disaster_id INTEGER,
+    disaster_name TEXT,
+    disaster_glide TEXT,
+    disaster_type TEXT,
+    disaster_status TEXT,
+    content_hash TEXT
+);
+
+ALTER TABLE test_reports ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+CREATE TABLE IF NOT EXISTS user_table (
+    user_id SERIAL PRIMARY KEY,
+    email TEXT,
+    username TEXT,
+    date_created TIMESTAMP WITH TIME ZONE
+);
@@ -0,0 +1,31 @@
+-- migrate: no-transaction
+-- Built CONCURRENTLY so applying this to a live table doesn't block ingestion.
+
+-- /grab-initial-events, /events/markers, /last-updated and /reports paging
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test_reports_date
+    ON test_reports (date_report_created DESC, report_id DESC);
+
+-- ST_DWithin on geom from LLM-generated SQL
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test_reports_geom
+    ON test_reports USING GIST (geom);
+
+-- planar bounding-box lookups from /events/viewport
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test_reports_geom_planar
+    ON test_reports USING GIST ((geom::geometry));
+
+-- country / type filters the LLM prompt asks for
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test_reports_country
+    ON test_reports (primary_country);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test_reports_country_short
+    ON test_reports (primary_country_shortname);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test_reports_disaster_type
+    ON test_reports (disaster_type);
+
+-- ILIKE '%keyword%' searches on titles and bodies
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test_reports_title_trgm
+    ON test_reports USING GIN (headline_title gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test_reports_summary_trgm
+    ON test_reports USING GIN (headline_summary gin_trgm_ops);
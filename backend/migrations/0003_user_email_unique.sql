@@ -0,0 +1,7 @@
+-- create_jwt upserts users by email, which needs a unique email. Older
+-- check-then-insert logins could race and leave duplicates; keep the oldest.
+DELETE FROM user_table a
+USING user_table b
+WHERE a.email = b.email AND a.user_id > b.user_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_table_email ON user_table (email);
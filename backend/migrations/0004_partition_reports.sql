@@ -0,0 +1,91 @@
+-- Monthly range partitioning of test_reports on date_report_created, so the
+-- recent-window reads only touch the newest partitions and old months can be
+-- detached by app.partitions instead of deleted row by row. The primary key
+-- has to include the partition key; bulk_insert upserts on both columns.
+--
+-- This rewrites the table once, holding its lock for the copy.
+ALTER TABLE test_reports RENAME TO test_reports_unpartitioned;
+
+CREATE TABLE test_reports (
+    report_id INTEGER NOT NULL,
+    primary_country TEXT NOT NULL,
+    primary_country_iso3 TEXT NOT NULL,
+    primary_country_shortname TEXT,
+    country_lat REAL NOT NULL,
+    country_long REAL NOT NULL,
+    geom GEOGRAPHY(Point, 4326),
+    date_report_created TIMESTAMP WITH TIME ZONE NOT NULL,
+    headline_title TEXT,
+    headline_summary TEXT,
+    language TEXT,
+    source_name TEXT,
+    source_homepage TEXT,
+    report_url_alias TEXT,
+    disaster_id INTEGER,
+    disaster_name TEXT,
+    disaster_glide TEXT,
+    disaster_type TEXT,
+    disaster_status TEXT,
+    content_hash TEXT,
+    PRIMARY KEY (report_id, date_report_created)
+) PARTITION BY RANGE (date_report_created);
+
+-- Creates the partition holding the (UTC) month of month_start if it's missing
+-- and returns its name. Safe to call concurrently from several workers.
+CREATE OR REPLACE FUNCTION ensure_report_partition(month_start DATE) RETURNS TEXT AS $$
+DECLARE
+    first_day DATE := date_trunc('month', month_start)::date;
+    partition_name TEXT := format('test_reports_%s', to_char(first_day, 'YYYY_MM'));
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF test_reports FOR VALUES FROM (%L) TO (%L)',
+            partition_name,
+            first_day::timestamp AT TIME ZONE 'UTC',
+            (first_day + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+        );
+    END IF;
+    RETURN partition_name;
+EXCEPTION WHEN duplicate_table OR unique_violation THEN
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- every month with existing reports, through two months from now
+SELECT ensure_report_partition(month::date)
+FROM generate_series(
+    date_trunc('month', COALESCE((SELECT MIN(date_report_created) FROM test_reports_unpartitioned), now()) AT TIME ZONE 'UTC'),
+    date_trunc('month', GREATEST((SELECT MAX(date_report_created) FROM test_reports_unpartitioned), now()) AT TIME ZONE 'UTC')
+        + interval '2 months',
+    interval '1 month'
+) AS month;
+
+INSERT INTO test_reports (
+    report_id, primary_country, primary_country_iso3, primary_country_shortname,
+    country_lat, country_long, geom, date_report_created, headline_title,
+    headline_summary, language, source_name, source_homepage, report_url_alias,
+    disaster_id, disaster_name, disaster_glide, disaster_type, disaster_status,
+    content_hash
+)
+SELECT
+    report_id, primary_country, primary_country_iso3, primary_country_shortname,
+    country_lat, country_long, geom, date_report_created, headline_title,
+    headline_summary, language, source_name, source_homepage, report_url_alias,
+    disaster_id, disaster_name, disaster_glide, disaster_type, disaster_status,
+    content_hash
+FROM test_reports_unpartitioned;
+
+DROP TABLE test_reports_unpartitioned;
+
+-- same indexes as 0002, now partitioned: created on every partition and on
+-- each new one automatically
+CREATE INDEX idx_test_reports_date ON test_reports (date_report_created DESC, report_id DESC);
+CREATE INDEX idx_test_reports_geom ON test_reports USING GIST (geom);
+CREATE INDEX idx_test_reports_geom_planar ON test_reports USING GIST ((geom::geometry));
+CREATE INDEX idx_test_reports_country ON test_reports (primary_country);
+CREATE INDEX idx_test_reports_country_short ON test_reports (primary_country_shortname);
+CREATE INDEX idx_test_reports_disaster_type ON test_reports (disaster_type);
+CREATE INDEX idx_test_reports_title_trgm ON test_reports USING GIN (headline_title gin_trgm_ops);
+CREATE INDEX idx_test_reports_summary_trgm ON test_reports USING GIN (headline_summary gin_trgm_ops);
+
+ANALYZE test_reports;
@@ -0,0 +1,30 @@
+-- Near-duplicate clusters (see app/dedupe.py). Reports whose title and
+-- summary are near-identical within the same country and disaster share a
+-- cluster_id: the report_id of the first report seen in the cluster.
+ALTER TABLE test_reports ADD COLUMN IF NOT EXISTS cluster_id INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_test_reports_cluster ON test_reports (cluster_id);
+
+-- MinHash signatures of recently ingested reports, kept for
+-- DEDUPE_WINDOW_DAYS so new reports can be matched against them
+CREATE TABLE IF NOT EXISTS report_minhash (
+    report_id INTEGER PRIMARY KEY,
+    scope TEXT NOT NULL,
+    date_report_created TIMESTAMP WITH TIME ZONE NOT NULL,
+    signature INTEGER[] NOT NULL,
+    cluster_id INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_report_minhash_date ON report_minhash (date_report_created);
+
+-- LSH band buckets: two reports landing in the same (scope, band, bucket)
+-- are candidates, confirmed by comparing their full signatures
+CREATE TABLE IF NOT EXISTS report_lsh_buckets (
+    scope TEXT NOT NULL,
+    band SMALLINT NOT NULL,
+    bucket INTEGER NOT NULL,
+    report_id INTEGER NOT NULL REFERENCES report_minhash (report_id) ON DELETE CASCADE,
+    PRIMARY KEY (scope, band, bucket, report_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_report_lsh_buckets_report ON report_lsh_buckets (report_id);
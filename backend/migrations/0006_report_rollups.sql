@@ -0,0 +1,35 @@
+-- Daily report counts per country, disaster type and disaster status, kept
+-- up to date by bulk_insert (see app/rollups.py) so /stats and aggregate LLM
+-- questions never scan test_reports. Unknown type/status are stored as ''.
+-- `reports` counts raw rows, near-duplicates included; `events` counts only
+-- cluster roots (COALESCE(cluster_id, report_id) = report_id), i.e. each
+-- near-duplicate cluster once, on the day and key of its earliest report.
+-- Counts outlive partition retention: detaching old months doesn't touch them.
+CREATE TABLE IF NOT EXISTS report_daily_counts (
+    day DATE NOT NULL,
+    primary_country TEXT NOT NULL,
+    primary_country_shortname TEXT,
+    country_lat REAL,
+    country_long REAL,
+    disaster_type TEXT NOT NULL DEFAULT '',
+    disaster_status TEXT NOT NULL DEFAULT '',
+    reports INTEGER NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, primary_country, disaster_type, disaster_status)
+);
+
+CREATE INDEX IF NOT EXISTS idx_report_daily_counts_country ON report_daily_counts (primary_country, day);
+CREATE INDEX IF NOT EXISTS idx_report_daily_counts_type ON report_daily_counts (disaster_type, day);
+
+INSERT INTO report_daily_counts (
+    day, primary_country, primary_country_shortname, country_lat, country_long,
+    disaster_type, disaster_status, reports, events
+)
+SELECT
+    (date_report_created AT TIME ZONE 'UTC')::date, primary_country,
+    MAX(primary_country_shortname), MAX(country_lat), MAX(country_long),
+    COALESCE(disaster_type, ''), COALESCE(disaster_status, ''), COUNT(*),
+    COUNT(*) FILTER (WHERE COALESCE(cluster_id, report_id) = report_id)
+FROM test_reports
+GROUP BY 1, 2, 6, 7
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,31 @@
+import argparse
+import json
+from datetime import datetime, timezone
+from app.tasks import backfill_range, backfill_status
+
+# Backfills an arbitrary date range, e.g.
+#
+#   python run_backfill.py 2025-01-01 2025-03-01 --partition day
+#   python run_backfill.py 2025-01-01 2025-03-01 --status
+#
+# Re-running the same range and partition resumes an interrupted backfill.
+# Set BACKFILL_PAGES_PER_MINUTE to throttle the fetch rate across workers.
+def as_utc(value):
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser()
+    cli.add_argument("start")
+    cli.add_argument("end")
+    cli.add_argument("--partition", choices=["day", "hour"], default="day")
+    cli.add_argument("--status", action="store_true")
+    args = cli.parse_args()
+
+    start, end = as_utc(args.start).isoformat(), as_utc(args.end).isoformat()
+    if args.status:
+        print(json.dumps(backfill_status(start, end, args.partition)))
+    else:
+        print(f"[runner] starting at {datetime.now(timezone.utc).isoformat()}")
+        job_key = backfill_range.apply(args=(start, end, args.partition)).get()
+        print(f"[runner] backfill {job_key} dispatched")
@@ -4,4 +4,4 @@ from app.tasks import refresh_db
 if __name__ == "__main__":
     print(f"[runner] starting at {datetime.now(timezone.utc).isoformat()}")
     refresh_db.apply()         
-    print("[runner] done")
+    print("[runner] refresh pipeline dispatched")
@@ -0,0 +1,66 @@
+from datetime import datetime, timezone
+import pytest
+from app import bulk_insert
+from app.bulk_insert import REPORT_COLUMNS, content_hash, prepare_rows
+
+def report(**changes):
+    row = {
+        "report_id": 1, "primary_country": "India", "primary_country_iso3": "IND",
+        "primary_country_shortname": "India", "country_lat": 20.0, "country_long": 78.0,
+        "date_report_created": "2024-01-02T00:00:00+00:00", "headline_title": "Floods",
+        "headline_summary": "Rain\x00fall", "language": "English", "source_name": "OCHA",
+        "source_homepage": "https://www.unocha.org", "report_url_alias": "/report/1",
+        "disaster_id": None, "disaster_name": None, "disaster_glide": None,
+        "disaster_type": None, "disaster_status": None,
+    }
+    row.update(changes)
+    return [row[col] for col in REPORT_COLUMNS]
+
+@pytest.fixture
+def dropped(monkeypatch):
+    counts = {}
+    monkeypatch.setattr(bulk_insert.ingest_dropped, "inc_many", counts.update)
+    return counts
+
+def test_valid_rows_keep_column_order_and_get_their_hash(dropped):
+    stats = {"failed": 0}
+    rows = prepare_rows([report(), report(report_id="2", disaster_id="7")], stats)
+
+    assert stats["failed"] == 0 and dropped == {}
+    assert [row[0] for row in rows] == [1, 2]
+    first = rows[0]
+    assert len(first) == len(REPORT_COLUMNS) + 1
+    assert first[REPORT_COLUMNS.index("date_report_created")] == datetime(2024, 1, 2, tzinfo=timezone.utc)
+    assert first[REPORT_COLUMNS.index("headline_summary")] == "Rainfall"
+    assert rows[1][REPORT_COLUMNS.index("disaster_id")] == 7
+    assert first[-1] == content_hash(first[:-1])
+
+def test_invalid_rows_are_counted_per_reason(dropped):
+    stats = {"failed": 0}
+    rows = prepare_rows([
+        report(),
+        report(report_id=2)[:-1],
+        report(report_id=3, country_lat=95.0),
+        report(report_id=4, country_long=-200.0),
+        report(report_id=5, country_lat=None),
+        report(report_id="x"),
+        report(report_id=None),
+        report(report_id=8, date_report_created="yesterday"),
+        report(report_id=9, primary_country_iso3=""),
+    ], stats)
+
+    assert [row[0] for row in rows] == [1]
+    assert stats["failed"] == 8
+    assert dropped == {
+        "malformed": 1,
+        "coordinates_out_of_range": 2,
+        "missing_country_lat": 1,
+        "invalid_report_id": 1,
+        "missing_report_id": 1,
+        "invalid_date_report_created": 1,
+        "missing_primary_country_iso3": 1,
+    }
+
+def test_content_hash_tells_missing_from_empty():
+    assert content_hash(report(disaster_name=None)) != content_hash(report(disaster_name=""))
+    assert content_hash(report()) != content_hash(report(headline_title="Flood"))
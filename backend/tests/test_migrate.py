@@ -0,0 +1,19 @@
+from app.migrate import split_statements
+
+def test_splits_on_top_level_semicolons():
+    assert split_statements("SELECT 1;\nSELECT 2;\n\n") == ["SELECT 1", "SELECT 2"]
+
+def test_semicolons_in_quotes_do_not_split():
+    sql = "INSERT INTO t VALUES ('a;b', 'it''s;'); SELECT \"odd;name\" FROM t"
+    assert split_statements(sql) == [
+        "INSERT INTO t VALUES ('a;b', 'it''s;')",
+        'SELECT "odd;name" FROM t',
+    ]
+
+def test_dollar_quoted_bodies_do_not_split():
+    body = "CREATE FUNCTION f() RETURNS void AS $fn$ BEGIN PERFORM 1; PERFORM $$;$$; END $fn$ LANGUAGE plpgsql"
+    assert split_statements(f"{body}; SELECT $q$ ; $q$") == [body, "SELECT $q$ ; $q$"]
+
+def test_comments_are_dropped_and_do_not_split():
+    sql = "SELECT 1 -- not; here\n; /* nor; here */ CREATE INDEX CONCURRENTLY i ON t (c);"
+    assert split_statements(sql) == ["SELECT 1", "CREATE INDEX CONCURRENTLY i ON t (c)"]
@@ -0,0 +1,34 @@
+import pytest
+from app.sql_guard import SQL_ROW_CAP, UnsafeQueryError, prepare_generated_sql
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1; SELECT 2",
+    "SELECT * FROM test_reports; DROP TABLE test_reports",
+    "DELETE FROM test_reports",
+    "UPDATE test_reports SET title = 'x'",
+    "WITH gone AS (DELETE FROM test_reports RETURNING *) SELECT * FROM gone",
+    "SELECT * FROM test_reports FOR UPDATE",
+])
+def test_rejects_multiple_statements_and_writes(sql):
+    with pytest.raises(UnsafeQueryError):
+        prepare_generated_sql(sql)
+
+def test_keywords_and_semicolons_inside_literals_are_allowed():
+    sql = "SELECT * FROM test_reports WHERE title = 'Drop; in cases' LIMIT 10"
+    assert prepare_generated_sql(sql + ";") == sql
+
+def test_trailing_limit_above_cap_is_rewritten():
+    sql = f"SELECT title FROM test_reports ORDER BY report_id LIMIT {SQL_ROW_CAP + 1} OFFSET 5"
+    assert prepare_generated_sql(sql) == (
+        f"SELECT title FROM test_reports ORDER BY report_id LIMIT {SQL_ROW_CAP} OFFSET 5"
+    )
+
+def test_trailing_limit_below_cap_is_kept():
+    sql = "SELECT title FROM test_reports WHERE title = 'a' LIMIT 5"
+    assert prepare_generated_sql(sql) == sql
+
+def test_query_without_limit_is_wrapped():
+    sql = "SELECT primary_country, COUNT(*) FROM test_reports GROUP BY 1"
+    assert prepare_generated_sql(sql + " ;\n") == (
+        f"SELECT * FROM ({sql}) AS capped LIMIT {SQL_ROW_CAP}"
+    )